@@ -0,0 +1,42 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Builds the collection app in updated_application/, run from the repository
+# root: pyinstaller new_application.spec
+
+
+a = Analysis(
+    ['updated_application/new_application.py'],
+    pathex=['updated_application'],
+    binaries=[],
+    # Looked up through app_paths.bundle_path in the unpack directory
+    datas=[('updated_application/exercise_config.json', '.')],
+    # Imported by name in preload_pipeline, PyInstaller can't see those
+    hiddenimports=['session', 'rate_monitor', 'connection_manager'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=[],
+    noarchive=False,
+    optimize=0,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    a.binaries,
+    a.datas,
+    [],
+    name='new_application',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    runtime_tmpdir=None,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
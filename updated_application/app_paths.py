@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Files shipped with the application are looked up next to the code, or in
+# the unpack directory of a PyInstaller build, never relative to the working
+# directory. Data the app writes (data/, the catalog, school_name.txt) stays
+# relative to the working directory.
+BUNDLE_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+
+
+def bundle_path(name):
+    return os.path.join(BUNDLE_DIR, name)
+
+
+EXERCISE_CONFIG_PATH = bundle_path('exercise_config.json')
@@ -0,0 +1,190 @@
+import argparse
+import heapq
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from ble_simulator import SimulatedSensor
+from instrumentation import percentile
+from replay import paced, recorded_config, session_packets
+from session import Session
+from session_reader import load_exercise_config, open_session
+from timing import now_ns
+
+RESULTS_FILENAME = 'benchmark_results.jsonl'
+SPEEDS = (1.0, 10.0, 100.0)
+DURATION = 10.0  # seconds of data per run
+# Metrics compared between versions, and whether higher is better
+COMPARED = {
+    "samples_per_s": True,
+    "handler_us_p50": False,
+    "handler_us_p99": False,
+    "cpu_us_per_sample": False,
+    "bytes_written": False,
+}
+
+
+def synthetic_stream(sensor_ids, duration, seed=0, **options):
+    # Simulated packets of every sensor merged in time order, as
+    # (offset_ns, sensor_id, packet)
+    streams = []
+    for sensor_id in sensor_ids:
+        sensor = SimulatedSensor(f"Sensor {sensor_id}", seed=seed, **options)
+        streams.append([(offset_ns, sensor_id, packet) for offset_ns, packet in sensor.packets_for(duration)])
+    return list(heapq.merge(*streams, key=lambda item: item[0]))
+
+
+def default_exercises(exercise_config):
+    # The first 2 sensor and the first 4 sensor exercise
+    chosen = {}
+    for name, config in exercise_config.items():
+        chosen.setdefault(len(config["sensors"]), name)
+    return [chosen[count] for count in (2, 4) if count in chosen]
+
+
+def run_case(exercise_name, config, packets, speed, session_format="csv"):
+    # Feeds packets through a Session (framing, parsing, timestamping,
+    # fusion, writing) paced at speed times real time, speed 0 runs as fast
+    # as possible. The packets keep their recorded arrival times, so the
+    # output is the same at every speed.
+    handler_ns = []
+    max_lag_ns = 0
+    samples = 0
+    with tempfile.TemporaryDirectory() as directory:
+        session = Session(exercise_name, config, "benchmark", directory, session_format=session_format)
+        cpu_started = time.process_time_ns()
+        wall_started = now_ns()
+        for arrival_ns, sensor_id, packet, lag_ns in paced(packets, speed, wall_started):
+            max_lag_ns = max(max_lag_ns, lag_ns)
+            started = now_ns()
+            session.handle_packet(arrival_ns, packet, sensor_id)
+            handler_ns.append(now_ns() - started)
+            samples += packet.count(b"\n")
+        metadata = session.close()
+        elapsed_ns = now_ns() - wall_started
+        cpu_ns = time.process_time_ns() - cpu_started
+        bytes_written = session.writer.writer.bytes_written
+    return {
+        "exercise": exercise_name,
+        "sensors": len(config["sensors"]),
+        "speed": speed,
+        "format": session_format,
+        "packets": len(packets),
+        "samples": samples,
+        "rows": metadata["rows"],
+        "bad_lines": metadata["errors"],
+        "elapsed_s": elapsed_ns / 1e9,
+        "samples_per_s": samples / (elapsed_ns / 1e9),
+        "handler_us_p50": percentile(handler_ns, 0.5) / 1e3,
+        "handler_us_p99": percentile(handler_ns, 0.99) / 1e3,
+        "cpu_us_per_sample": cpu_ns / max(samples, 1) / 1e3,
+        "max_lag_ms": max_lag_ns / 1e6,
+        "bytes_written": bytes_written,
+    }
+
+
+def case_key(result):
+    return (result["exercise"], result["speed"], result["format"])
+
+
+def code_version():
+    # Commit of the tree being measured, so stored results can be told apart
+    try:
+        version = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = ""
+    return version or "unknown"
+
+
+def load_results(path=RESULTS_FILENAME):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def store_results(results, path=RESULTS_FILENAME):
+    # One JSON line per case, appended so earlier versions stay comparable
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+
+def previous_result(history, result):
+    # Latest stored run of the same case from another version
+    for stored in reversed(history):
+        if case_key(stored) == case_key(result) and stored.get("version") != result["version"]:
+            return stored
+    return None
+
+
+def format_result(result, previous=None):
+    text = (f"{result['exercise']} ({result['sensors']} sensors) at {result['speed']:g}x: "
+            f"{result['samples_per_s']:.0f} samples/s, handler p50 {result['handler_us_p50']:.1f} us "
+            f"p99 {result['handler_us_p99']:.1f} us, {result['cpu_us_per_sample']:.2f} us CPU/sample, "
+            f"{result['bytes_written'] / 1024:.1f} KB written, lag {result['max_lag_ms']:.1f} ms")
+    if previous is None:
+        return text
+    changes = []
+    for metric, higher_is_better in COMPARED.items():
+        before, after = previous.get(metric), result[metric]
+        if not before:
+            continue
+        change = (after - before) / before * 100
+        worse = change < 0 if higher_is_better else change > 0
+        marker = " (worse)" if worse and abs(change) >= 10 else ""
+        changes.append(f"{metric} {change:+.1f}%{marker}")
+    return f"{text}\n    vs {previous['version']}: {', '.join(changes)}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline")
+    parser.add_argument("--exercise", action="append", help="exercise from exercise_config.json (repeatable), "
+                                                             "default the first 2 and 4 sensor exercises")
+    parser.add_argument("--recorded", action="append", default=[],
+                        help="recorded session to replay (repeatable), runs only these "
+                                                                 "unless --exercise is given too")
+    parser.add_argument("--speed", type=float, action="append", help="real time multiplier (repeatable), "
+                                                                     "0 runs unpaced, default 1, 10 and 100")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds of data per run")
+    parser.add_argument("--format", choices=["csv", "binary"], default="csv", help="session file format")
+    parser.add_argument("--jitter", type=float, default=2.0, help="simulated packet jitter in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default=RESULTS_FILENAME, help="file the results are appended to")
+    parser.add_argument("--no-store", action="store_true", help="don't append the results")
+    args = parser.parse_args(argv)
+
+    exercise_config = load_exercise_config()
+    exercises = args.exercise or ([] if args.recorded else default_exercises(exercise_config))
+    speeds = args.speed or SPEEDS
+    history = load_results(args.results)
+    version = code_version()
+    cases = []
+    for exercise_name in exercises:
+        config = exercise_config[exercise_name]
+        packets = synthetic_stream(config["sensors"], args.duration, seed=args.seed, jitter_ms=args.jitter)
+        cases.append((exercise_name, config, packets))
+    for path in args.recorded:
+        recorded = open_session(path, exercise_config)
+        config = recorded_config(recorded, exercise_config)
+        # Recorded cases are told apart from synthetic ones by the file name
+        cases.append((os.path.basename(path), config, session_packets(recorded, config["sensors"])))
+    results = []
+    for exercise_name, config, packets in cases:
+        for speed in speeds:
+            result = run_case(exercise_name, config, packets, speed, args.format)
+            result.update(version=version, date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                          python=platform.python_version(), machine=platform.machine())
+            print(format_result(result, previous_result(history, result)))
+            results.append(result)
+    if not args.no_store:
+        store_results(results, args.results)
+
+
+if __name__ == "__main__":
+    main()
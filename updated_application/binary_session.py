@@ -0,0 +1,198 @@
+import argparse
+import csv
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from session_writer import SessionWriter, complete_rows
+
+# Layout of a binary session file:
+#   8 bytes   magic
+#   4 bytes   little endian uint32, length of the JSON header
+#   n bytes   JSON header, space padded so the records start 4 byte aligned
+#   records   one little endian float32 per column, timestamp first
+MAGIC = b"IMUSESS1"
+RECORD_DTYPE = "<f4"
+BINARY_EXTENSION = ".imu"
+_PREFIX = struct.Struct("<8sI")
+
+
+def encode_header(columns, sensors=None, rate_hz=None, **metadata):
+    header = {
+        "version": 1,
+        "dtype": RECORD_DTYPE,
+        "columns": list(columns),
+        "sensors": list(sensors or []),
+        "rate_hz": rate_hz,
+        "created": time.time(),
+    }
+    header.update(metadata)
+    body = json.dumps(header).encode('utf-8')
+    body += b" " * (-(_PREFIX.size + len(body)) % 4)
+    return _PREFIX.pack(MAGIC, len(body)) + body
+
+
+def read_header(path):
+    # Returns (header dict, byte offset of the first record)
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) != _PREFIX.size:
+            raise ValueError(f"{path} is too short to be a binary session")
+        magic, length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary session file")
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header, _PREFIX.size + length
+
+
+def is_binary_session(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class BinarySessionWriter(SessionWriter):
+    # Append only fixed width records, no text formatting on the collection
+    # path. Same interface and flush/fsync behaviour as SessionWriter.
+    def __init__(self, filename, columns, sensors=None, rate_hz=None, metadata=None, **kwargs):
+        self.sensors = list(sensors or [])
+        self.rate_hz = rate_hz
+        self.metadata = dict(metadata or {})
+        super().__init__(filename, columns, **kwargs)
+
+    def _open(self):
+        file = open(self.filename, 'wb', buffering=1 << 16)
+        file.write(encode_header(self.columns, self.sensors, self.rate_hz, **self.metadata))
+        return file
+
+    def write_block(self, timestamps, values):
+        count = len(timestamps)
+        if count == 0:
+            return
+        if values.shape[1] != len(self.columns) - 1:
+            raise ValueError(f"Block has {values.shape[1] + 1} columns, expected {len(self.columns)}")
+        records = np.empty((count, len(self.columns)), dtype=RECORD_DTYPE)
+        records[:, 0] = timestamps
+        records[:, 1:] = values
+        self._file.write(records.data)
+        self._pending += count
+        self.flush_if_due()
+
+
+def load_records(path):
+    # Memory maps the records of a binary session as a (n, columns) array
+    header, offset = read_header(path)
+    width = len(header["columns"])
+    size = os.path.getsize(path) - offset
+    count = size // (width * 4)
+    if count == 0:
+        return header, np.empty((0, width), dtype=header["dtype"])
+    records = np.memmap(path, dtype=header["dtype"], mode='r', offset=offset, shape=(count, width))
+    return header, records
+
+
+def complete_runs(values):
+    # (start, end) of every run of consecutive rows without NaN
+    complete = complete_rows(values).view(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], complete, [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def convert_to_csv(path, csv_path=None, chunk_rows=65536):
+    # Rows in a sensor's gap are left out, like in CSVs recorded directly
+    header, records = load_records(path)
+    if csv_path is None:
+        csv_path = os.path.splitext(path)[0] + ".csv"
+    row_format = ",".join(["%.3f"] + ["%.7g"] * (len(header["columns"]) - 1)) + "\n"
+    with open(csv_path, 'w', newline='') as f:
+        csv.writer(f).writerow(header["columns"])
+        for start in range(0, len(records), chunk_rows):
+            chunk = records[start:start + chunk_rows]
+            chunk = chunk[complete_rows(chunk[:, 1:])].tolist()
+            f.write("".join([row_format % tuple(row) for row in chunk]))
+    return csv_path
+
+
+def convert_from_csv(csv_path, path=None, sensors=None, rate_hz=None, **metadata):
+    # Builds a binary session from a recorded CSV so it can be memory mapped
+    if path is None:
+        path = os.path.splitext(csv_path)[0] + BINARY_EXTENSION
+    with open(csv_path, newline='') as f:
+        columns = next(csv.reader(f))
+        values = np.loadtxt(f, delimiter=',', dtype=np.float32, ndmin=2)
+    if values.size == 0:
+        values = np.empty((0, len(columns)), dtype=np.float32)
+    metadata.setdefault("source", os.path.basename(csv_path))
+    with open(path, 'wb') as f:
+        f.write(encode_header(columns, sensors, rate_hz, **metadata))
+        f.write(np.ascontiguousarray(values, dtype=RECORD_DTYPE).data)
+    return path
+
+
+def _sensor_units(column):
+    if "Accel" in column:
+        return "m/s2"
+    if "Gyro" in column:
+        return "dps"
+    return "N/A"
+
+
+def convert_to_edge_impulse_json(path, json_path=None, device_name="Sense", device_type="SENSE_IMU"):
+    # Edge Impulse data acquisition format, unsigned. The format has a fixed
+    # interval and no timestamps, so a session with gaps is split into one
+    # file per stretch without a gap: <name>.1.json, <name>.2.json, ...
+    # Returns the paths written.
+    header, records = load_records(path)
+    if json_path is None:
+        json_path = os.path.splitext(path)[0] + ".json"
+    columns = header["columns"][1:]
+    if header.get("rate_hz"):
+        interval_ms = 1000.0 / header["rate_hz"]
+    elif len(records) > 1:
+        interval_ms = float(records[-1, 0] - records[0, 0]) / (len(records) - 1)
+    else:
+        interval_ms = 0.0
+    runs = complete_runs(records[:, 1:])
+    if len(runs) <= 1:
+        parts = [(json_path, runs[0] if runs else (0, 0))]
+    else:
+        base, ext = os.path.splitext(json_path)
+        parts = [(f"{base}.{k}{ext}", run) for k, run in enumerate(runs, 1)]
+    for part_path, (start, end) in parts:
+        document = {
+            "protected": {"ver": "v1", "alg": "none", "iat": int(header.get("created", time.time()))},
+            "signature": "0" * 64,
+            "payload": {
+                "device_name": device_name,
+                "device_type": device_type,
+                "interval_ms": interval_ms,
+                "sensors": [{"name": name, "units": _sensor_units(name)} for name in columns],
+                "values": np.asarray(records[start:end, 1:], dtype=np.float64).round(6).tolist(),
+            },
+        }
+        with open(part_path, 'w') as f:
+            json.dump(document, f, allow_nan=False)
+    return [part_path for part_path, _ in parts]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert binary session files")
+    parser.add_argument("files", nargs="+", help="binary session files (.imu)")
+    parser.add_argument("--format", choices=["csv", "ei"], default="csv",
+                        help="csv, or ei for Edge Impulse data acquisition JSON")
+    args = parser.parse_args(argv)
+    for path in args.files:
+        if args.format == "csv":
+            print(convert_to_csv(path))
+        else:
+            for json_path in convert_to_edge_impulse_json(path):
+                print(json_path)
+
+
+if __name__ == "__main__":
+    main()
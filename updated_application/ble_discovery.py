@@ -0,0 +1,88 @@
+import json
+
+DEVICE_CACHE_FILENAME = 'sensor_devices.json'
+SCAN_TIMEOUT = 10.0
+
+
+class DeviceCache:
+    # Sensor name -> BLE address, kept between runs so a warm start can
+    # connect straight to the known addresses without scanning. Pinned
+    # addresses (from stations.json) take precedence, are never forgotten
+    # and aren't saved with the learned ones.
+    def __init__(self, path=DEVICE_CACHE_FILENAME):
+        self.path = path
+        self.pinned = {}
+        try:
+            with open(path) as f:
+                self.addresses = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.addresses = {}
+
+    def get(self, name):
+        return self.pinned.get(name) or self.addresses.get(name)
+
+    def pin(self, name, address):
+        self.pinned[name] = address
+
+    def is_pinned(self, name):
+        return name in self.pinned
+
+    def pinned_addresses(self):
+        return set(self.pinned.values())
+
+    def update(self, name, address):
+        if self.addresses.get(name) != address:
+            self.addresses[name] = address
+            self.save()
+
+    def forget(self, name):
+        if self.addresses.pop(name, None) is not None:
+            self.save()
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.addresses, f, indent=4)
+
+
+async def discover_sensors(names, timeout=SCAN_TIMEOUT, scanner_class=None, ignore_addresses=()):
+    # Scans until every name in names has been seen, or timeout. Returns
+    # name -> BLEDevice for the sensors found, devices at ignore_addresses
+    # (another kit's pinned sensors) are skipped. scanner_class defaults to
+    # bleak's and can be swapped for ble_simulator's scanner.
+    # asyncio and bleak are only imported once the first scan runs,
+    # DeviceCache is used at startup
+    import asyncio
+    if scanner_class is None:
+        from bleak import BleakScanner as scanner_class
+    wanted = set(names)
+    found = {}
+    all_found = asyncio.Event()
+
+    def detection_callback(device, advertisement_data):
+        name = device.name or advertisement_data.local_name
+        if name in wanted and name not in found and device.address not in ignore_addresses:
+            found[name] = device
+            if len(found) == len(wanted):
+                all_found.set()
+
+    if not wanted:
+        return found
+    async with scanner_class(detection_callback=detection_callback):
+        try:
+            await asyncio.wait_for(all_found.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    return found
+
+
+async def resolve_sensors(names, cache, timeout=SCAN_TIMEOUT, scanner_class=None):
+    # Returns name -> BLEDevice or cached address string, both can be handed
+    # to BleakClient. Only the sensors missing from the cache are scanned for.
+    targets = {name: cache.get(name) for name in names}
+    missing = [name for name, address in targets.items() if address is None]
+    if missing:
+        found = await discover_sensors(missing, timeout, scanner_class, ignore_addresses=cache.pinned_addresses())
+        for name, device in found.items():
+            cache.update(name, device.address)
+            targets[name] = device
+    return {name: target for name, target in targets.items() if target is not None}
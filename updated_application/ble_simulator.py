@@ -0,0 +1,361 @@
+import argparse
+import asyncio
+import math
+import os
+import random
+import tempfile
+import time
+import zlib
+
+# Stand-ins for BleakScanner and BleakClient that stream Sense style UART
+# notifications ("ax,ay,az,gx,gy,gz\n" lines) without any hardware. All
+# randomness comes from a per sensor seed, so a given configuration always
+# produces the same packets.
+
+DEFAULT_MTU = 20             # ATT payload of a default BLE 4.x connection
+DEFAULT_INTERVAL_MS = 15.0   # connection interval, notifications are sent in bursts
+SCAN_DELAY = 0.05            # seconds until a simulated sensor is "seen"
+
+
+class SimulatedSensor:
+    # Generates one sensor's notification packets. Samples are produced at
+    # rate_hz, each connection interval the buffered bytes go out in chunks of
+    # at most mtu bytes, so lines are split across packets like on the real
+    # devices. jitter_ms delays packets randomly, loss drops whole packets
+    # (leaving torn lines behind) and malformed replaces whole lines with
+    # broken ones. With mid_line a burst can stop inside a line and the rest
+    # goes out with the next one, so a recording can start mid-line.
+    def __init__(self, name, address=None, rate_hz=100.0, mtu=DEFAULT_MTU, interval_ms=DEFAULT_INTERVAL_MS,
+                 jitter_ms=0.0, loss=0.0, malformed=0.0, mid_line=False, seed=0):
+        self.name = name
+        self.address = address or _address(name)
+        self.rate_hz = float(rate_hz)
+        self.mtu = mtu
+        self.interval_ms = interval_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.malformed = malformed
+        self.mid_line = mid_line
+        self.seed = seed
+        self._phase = zlib.crc32(self.name.encode()) % 360 * math.pi / 180
+        self.reset()
+
+    def reset(self):
+        self._random = random.Random(zlib.crc32(self.name.encode()) ^ self.seed)
+        self.lines = 0
+        self.packets = 0
+        self.dropped_packets = 0
+        self.malformed_lines = 0
+
+    def line(self, index):
+        t = index / self.rate_hz
+        phase = self._phase
+        values = (
+            9.81 * math.sin(phase) + 2.0 * math.sin(2 * math.pi * 1.3 * t) + self._random.gauss(0, 0.05),
+            0.5 * math.cos(2 * math.pi * 0.7 * t) + self._random.gauss(0, 0.05),
+            9.81 * math.cos(phase) + self._random.gauss(0, 0.05),
+            30.0 * math.sin(2 * math.pi * 1.1 * t) + self._random.gauss(0, 0.5),
+            10.0 * math.cos(2 * math.pi * 0.9 * t) + self._random.gauss(0, 0.5),
+            self._random.gauss(0, 0.5),
+        )
+        self.lines += 1
+        if self.malformed and self._random.random() < self.malformed:
+            self.malformed_lines += 1
+            broken = ",".join("%.4f" % value for value in values[:self._random.randrange(1, 6)])
+            return (broken + "\n").encode()
+        return ("%.4f,%.4f,%.4f,%.4f,%.4f,%.4f\n" % values).encode()
+
+    def packets_for(self, duration_s=None):
+        # Yields (offset_ns, packet) from the start of streaming, forever if
+        # duration_s is None. Offsets are non decreasing.
+        pending = bytearray()
+        index = 0
+        interval_ns = int(self.interval_ms * 1e6)
+        last_ns = 0
+        event = 1
+        while duration_s is None or event * interval_ns <= duration_s * 1e9:
+            event_ns = event * interval_ns
+            while index * 1e9 / self.rate_hz <= event_ns:
+                pending += self.line(index)
+                index += 1
+            offset_ns = event_ns
+            if self.jitter_ms:
+                offset_ns += int(abs(self._random.gauss(0, self.jitter_ms)) * 1e6)
+            # A late burst holds back the next one, packets stay in order
+            offset_ns = last_ns = max(offset_ns, last_ns)
+            # Part of the last line held back for the next burst
+            held = 0
+            if self.mid_line and pending:
+                held = self._random.randrange(len(pending) - pending.rfind(b'\n', 0, len(pending) - 1) - 1)
+            while len(pending) > held:
+                packet = bytes(pending[:min(self.mtu, len(pending) - held)])
+                del pending[:len(packet)]
+                if self.loss and self._random.random() < self.loss:
+                    self.dropped_packets += 1
+                    continue
+                self.packets += 1
+                yield offset_ns, packet
+            event += 1
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "lines": self.lines,
+            "packets": self.packets,
+            "dropped_packets": self.dropped_packets,
+            "malformed_lines": self.malformed_lines,
+        }
+
+
+class SimulatedDevice:
+    # What the scanner hands out, like bleak's BLEDevice
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+
+    def __repr__(self):
+        return f"SimulatedDevice({self.name!r}, {self.address!r})"
+
+
+class SimulatedAdvertisement:
+    def __init__(self, local_name):
+        self.local_name = local_name
+
+
+class BleSimulator:
+    # A set of simulated sensors with scanner and client classes bound to
+    # them, e.g. ConnectionManager(sensors, client_class=simulator.client_class,
+    # scanner_class=simulator.scanner_class). speed > 1 streams faster than
+    # real time for load tests.
+    def __init__(self, sensors, speed=1.0):
+        self.sensors = {sensor.name: sensor for sensor in sensors}
+        self.speed = speed
+        self.clients = []
+        simulator = self
+
+        class Scanner(SimulatedScanner):
+            pass
+
+        class Client(SimulatedClient):
+            pass
+
+        Scanner.simulator = Client.simulator = simulator
+        self.scanner_class = Scanner
+        self.client_class = Client
+
+    def find(self, target):
+        # target is a device, an address or a name
+        key = getattr(target, "address", target)
+        for sensor in self.sensors.values():
+            if key in (sensor.address, sensor.name):
+                return sensor
+        return None
+
+    def disconnect(self, name):
+        # Drops the link to a sensor as if it went out of range, call on the
+        # loop the clients run on
+        for client in self.clients:
+            if client.sensor is not None and client.sensor.name == name and client.is_connected:
+                client._drop()
+
+    def stats(self):
+        return [sensor.stats() for sensor in self.sensors.values()]
+
+
+class SimulatedScanner:
+    simulator = None
+
+    def __init__(self, detection_callback=None, **kwargs):
+        self.detection_callback = detection_callback
+        self._task = None
+
+    async def _advertise(self):
+        await asyncio.sleep(SCAN_DELAY)
+        for sensor in self.simulator.sensors.values():
+            if self.detection_callback is not None:
+                self.detection_callback(SimulatedDevice(sensor.name, sensor.address),
+                                        SimulatedAdvertisement(sensor.name))
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._advertise())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+
+class SimulatedClient:
+    simulator = None
+
+    def __init__(self, address_or_device, disconnected_callback=None, timeout=10.0, **kwargs):
+        self.address = getattr(address_or_device, "address", address_or_device)
+        self.sensor = self.simulator.find(address_or_device)
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self._streams = {}
+        self.simulator.clients.append(self)
+
+    async def connect(self, **kwargs):
+        if self.sensor is None:
+            raise OSError(f"Device with address {self.address} was not found")
+        await asyncio.sleep(0)
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        was_connected = self.is_connected
+        self._close()
+        if was_connected and self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+        return True
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        if not self.is_connected:
+            raise OSError("Not connected")
+        self.sensor.reset()
+        self._streams[char_specifier] = asyncio.ensure_future(self._stream(callback))
+
+    async def stop_notify(self, char_specifier):
+        stream = self._streams.pop(char_specifier, None)
+        if stream is not None:
+            stream.cancel()
+
+    async def _stream(self, callback):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for offset_ns, packet in self.sensor.packets_for():
+            delay = start + offset_ns / 1e9 / self.simulator.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            callback(None, bytearray(packet))
+
+    def _close(self):
+        self.is_connected = False
+        for stream in self._streams.values():
+            stream.cancel()
+        self._streams.clear()
+
+    def _drop(self):
+        self._close()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+
+def _address(name):
+    # Stable fake MAC address per name
+    digest = zlib.crc32(name.encode()).to_bytes(4, "big")
+    return "F0:5E:" + ":".join(f"{byte:02X}" for byte in digest)
+
+
+def simulated_sensors(names, seed=0, **options):
+    return [SimulatedSensor(name, seed=seed, **options) for name in names]
+
+
+def simulated_config(count, rate_hz=100.0):
+    # An exercise config for count simulated sensors
+    columns = ["timestamp"] + [
+        f"sensor_{sensor}_{kind}_{axis}" for sensor in range(1, count + 1)
+        for kind in ("Accel", "Gyro") for axis in "XYZ"
+    ]
+    return {"sensors": list(range(1, count + 1)), "columns": columns, "rate_hz": rate_hz}
+
+
+def run_load(sensors, duration, speed=1.0, session_format="csv"):
+    # Streams the simulated sensors through a ConnectionManager into a
+    # Session for duration seconds of simulated time and reports how the
+    # ingestion path kept up. Timestamps come from the host clock, so with
+    # speed > 1 there are more lines than rows on the fixed rate grid.
+    from connection_manager import ConnectionManager
+    from ble_discovery import DeviceCache
+    from instrumentation import percentile
+    from session import Session
+    from timing import now_ns
+
+    simulator = BleSimulator(sensors, speed=speed)
+    config = simulated_config(len(sensors))
+    sensor_map = {i + 1: (sensor.name, "sim-uart-tx") for i, sensor in enumerate(sensors)}
+    latencies_ns = []
+    handling_ns = []
+    with tempfile.TemporaryDirectory() as directory:
+        session = Session("Simulated", config, "simulated", directory, session_format=session_format)
+
+        def on_packet(arrival_ns, data, sensor_id):
+            started = now_ns()
+            session.handle_packet(arrival_ns, data, sensor_id)
+            latencies_ns.append(started - arrival_ns)
+            handling_ns.append(now_ns() - started)
+
+        manager = ConnectionManager(sensor_map, device_cache=DeviceCache(os.path.join(directory, "devices.json")),
+                                    on_resume=session.sensor_resumed, client_class=simulator.client_class,
+                                    scanner_class=simulator.scanner_class)
+        try:
+            result = manager.start_recording(sensor_map, on_packet).result()
+            started = time.perf_counter()
+            time.sleep(duration / speed)
+            stop_latency_ms = manager.stop_recording()
+            elapsed = time.perf_counter() - started
+        finally:
+            manager.shutdown()
+        metadata = session.close(stop_latency_ms=stop_latency_ms)
+
+    packets = len(handling_ns)
+    sent = simulator.stats()
+    return {
+        "sensors": len(sensors),
+        "ready": result["ready"],
+        "elapsed_s": elapsed,
+        "packets": packets,
+        "packets_per_s": packets / elapsed,
+        "lines_sent": sum(sensor["lines"] for sensor in sent),
+        "rows": metadata["rows"],
+        "rows_per_s": metadata["rows"] / elapsed,
+        "bad_lines": metadata["errors"],
+        "malformed_lines_sent": sum(sensor["malformed_lines"] for sensor in sent),
+        "packets_lost": sum(sensor["dropped_packets"] for sensor in sent),
+        "queue_latency_ms_p50": percentile(latencies_ns, 0.5) / 1e6,
+        "queue_latency_ms_p99": percentile(latencies_ns, 0.99) / 1e6,
+        "handling_ms_p50": percentile(handling_ns, 0.5) / 1e6,
+        "handling_ms_p99": percentile(handling_ns, 0.99) / 1e6,
+        "stop_latency_ms": stop_latency_ms,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the ingestion path with simulated sensors")
+    parser.add_argument("--sensors", type=int, default=4, help="number of sensors")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of simulated data")
+    parser.add_argument("--speed", type=float, default=1.0, help="stream this many times faster than real time")
+    parser.add_argument("--rate", type=float, default=100.0, help="samples per second")
+    parser.add_argument("--mtu", type=int, default=DEFAULT_MTU)
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL_MS, help="connection interval in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="packet jitter in ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="packet loss probability")
+    parser.add_argument("--malformed", type=float, default=0.0, help="malformed line probability")
+    parser.add_argument("--mid-line", action="store_true", help="let bursts end in the middle of a line")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["csv", "binary"], default="csv", help="session file format")
+    parser.add_argument("--dump", action="store_true", help="print the packets instead of running the load test")
+    args = parser.parse_args(argv)
+    sensors = simulated_sensors([f"Sim Sensor {i + 1}" for i in range(args.sensors)], seed=args.seed,
+                                rate_hz=args.rate, mtu=args.mtu, interval_ms=args.interval,
+                                jitter_ms=args.jitter, loss=args.loss, malformed=args.malformed,
+                                mid_line=args.mid_line)
+    if args.dump:
+        for sensor in sensors:
+            for offset_ns, packet in sensor.packets_for(args.duration):
+                print(f"{sensor.name} {offset_ns / 1e6:9.3f} ms {packet!r}")
+            print(sensor.stats())
+        return
+    for key, value in run_load(sensors, args.duration, args.speed, args.format).items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import asyncio
+import concurrent.futures
+import threading
+
+from bleak import BleakClient, BleakScanner
+from bleak.exc import BleakError
+
+from ble_discovery import DeviceCache, discover_sensors, resolve_sensors
+from timing import now_ns
+
+CONNECT_ERRORS = (BleakError, asyncio.TimeoutError, OSError)
+CONNECT_TIMEOUT = 10.0      # seconds per connection attempt
+CONNECT_RETRIES = 3         # attempts after the first one
+RETRY_BACKOFF = 0.5         # first retry delay, doubled on every attempt
+FIRST_SAMPLE_TIMEOUT = 5.0  # seconds to wait for a sensor to start streaming
+MAX_RECONNECT_DELAY = 10.0  # cap on the backoff between reconnect attempts
+STOP_TIMEOUT = 2.0          # seconds stop_recording waits for queued packets
+
+
+class ConnectionManager:
+    # Owns one asyncio loop on a background thread and the BleakClients for
+    # the lifetime of the app. Sensors stay connected with notifications on
+    # between recordings, starting and stopping a recording only switches
+    # which sensors' packets are routed to on_packet.
+    #
+    # sensors maps sensor id -> (device name, notify characteristic UUID),
+    # on_packet(arrival_ns, data, sensor_id) runs on the manager's loop and
+    # can be replaced per recording. Recordings on disjoint sets of sensors
+    # (one per station) can run at the same time and are stopped separately.
+    # A sensor that drops is reconnected in the background, on_disconnect and
+    # on_reconnect(sensor_id) are called on the loop when that happens.
+    # on_resume(sensor_id, reconnected) is called from the sensor's packet
+    # consumer, in order with its packets, before the first packet of a new
+    # connection (reconnected True) and before the first packet of a
+    # recording (False), which starts wherever the stream is, usually
+    # mid-line.
+    # client_class and scanner_class default to bleak's, ble_simulator
+    # provides stand-ins for running without the sensors.
+    def __init__(self, sensors, on_packet=None, device_cache=None, on_disconnect=None, on_reconnect=None,
+                 on_resume=None, client_class=BleakClient, scanner_class=BleakScanner):
+        self.sensors = sensors
+        self.client_class = client_class
+        self.scanner_class = scanner_class
+        self.on_packet = on_packet
+        self.on_disconnect = on_disconnect
+        self.on_reconnect = on_reconnect
+        self.on_resume = on_resume
+        self.device_cache = device_cache if device_cache is not None else DeviceCache()
+        self.clients = {}
+        self._routing = frozenset()
+        self._handlers = {}
+        self._queues = {}
+        self._consumers = {}
+        self._first_packet = {}
+        self._reconnecting = {}
+        self._stop_requested = {}
+        self.stop_latency_ms = None
+        self._recording_started_ns = {}
+        self.first_sample_ms = {}
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="ble-connections", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        # Runs coro on the manager's loop, returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    @property
+    def recording(self):
+        return bool(self._routing)
+
+    def is_recording(self, sensor_id):
+        return sensor_id in self._routing
+
+    def is_connected(self, sensor_id):
+        client = self.clients.get(sensor_id)
+        return client is not None and client.is_connected
+
+    def connected(self, sensor_ids=None):
+        if sensor_ids is None:
+            sensor_ids = self.clients
+        return [sensor_id for sensor_id in sensor_ids if self.is_connected(sensor_id)]
+
+    async def connect(self, sensor_ids):
+        # Connects the sensors that aren't connected yet, returns the ids
+        # that are connected afterwards
+        missing = [sensor_id for sensor_id in sensor_ids if not self.is_connected(sensor_id)]
+        if missing:
+            names = {sensor_id: self.sensors[sensor_id][0] for sensor_id in missing}
+            targets = await resolve_sensors(names.values(), self.device_cache, scanner_class=self.scanner_class)
+            # All sensors connect concurrently, each with its own timeout
+            # and retry budget so one hung device doesn't hold up the rest
+            results = await asyncio.gather(
+                *(self._connect_with_retry(sensor_id, targets[name]) for sensor_id, name in names.items() if name in targets),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    print(f"Connection failed: {result}")
+        return self.connected(sensor_ids)
+
+    async def _connect_with_retry(self, sensor_id, target):
+        name = self.sensors[sensor_id][0]
+        for attempt in range(CONNECT_RETRIES + 1):
+            try:
+                await self._connect_sensor(sensor_id, target)
+                return
+            except CONNECT_ERRORS as e:
+                if attempt == CONNECT_RETRIES:
+                    raise
+                delay = RETRY_BACKOFF * 2 ** attempt
+                print(f"Connecting to {name} failed ({e or type(e).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _connect_sensor(self, sensor_id, target):
+        name, char_uuid = self.sensors[sensor_id]
+        try:
+            client = await self._open_client(sensor_id, target)
+        except CONNECT_ERRORS as e:
+            # A cached address can go stale (sensor swapped, address
+            # rotated), in that case scan for the sensor once. An address
+            # pinned in stations.json is the only way to find its sensor,
+            # that one is just retried.
+            if not isinstance(target, str) or self.device_cache.is_pinned(name):
+                raise
+            print(f"Cached address for {name} failed ({e}), scanning")
+            self.device_cache.forget(name)
+            found = await discover_sensors([name], scanner_class=self.scanner_class,
+                                           ignore_addresses=self.device_cache.pinned_addresses())
+            if name not in found:
+                raise
+            self.device_cache.update(name, found[name].address)
+            client = await self._open_client(sensor_id, found[name])
+        print(f"Connected to {name}")
+
+        packets = self._queues.get(sensor_id)
+        if packets is None:
+            packets = self._queues[sensor_id] = asyncio.Queue()
+            self._consumers[sensor_id] = asyncio.create_task(self._consume(packets, sensor_id))
+
+        def route(sender, data):
+            # Called by bleak on the loop, only takes the arrival time and
+            # enqueues while the sensor is part of a recording
+            if sensor_id in self._routing:
+                arrival_ns = now_ns()
+                packets.put_nowait((arrival_ns, data))
+                if sensor_id not in self.first_sample_ms:
+                    self._mark_streaming(sensor_id, arrival_ns)
+
+        if sensor_id in self._reconnecting:
+            # Packets routed from here on belong to the new connection, the
+            # marker tells the consumer where they start
+            packets.put_nowait((None, True))
+        try:
+            await asyncio.wait_for(client.start_notify(char_uuid, route), CONNECT_TIMEOUT)
+        except BaseException:
+            await client.disconnect()
+            raise
+        self.clients[sensor_id] = client
+
+    async def _open_client(self, sensor_id, target):
+        client = self.client_class(target, disconnected_callback=lambda client: self._disconnected(sensor_id, client),
+                             timeout=CONNECT_TIMEOUT)
+        try:
+            await asyncio.wait_for(client.connect(), CONNECT_TIMEOUT)
+        except BaseException:
+            # Don't leave a half open connection behind a timeout
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            raise
+        return client
+
+    def _disconnected(self, sensor_id, client):
+        # Ignore clients that were replaced or closed on purpose
+        if self.clients.get(sensor_id) is not client:
+            return
+        print(f"{self.sensors[sensor_id][0]} disconnected")
+        if self.on_disconnect is not None:
+            self.on_disconnect(sensor_id)
+        if sensor_id not in self._reconnecting:
+            self._reconnecting[sensor_id] = asyncio.create_task(self._reconnect(sensor_id, client.address))
+
+    async def _reconnect(self, sensor_id, address):
+        # Keeps trying with a capped backoff until the sensor is back, the
+        # other sensors are not affected
+        attempt = 0
+        try:
+            while not self.is_connected(sensor_id):
+                try:
+                    await self._connect_sensor(sensor_id, self.device_cache.get(self.sensors[sensor_id][0]) or address)
+                except CONNECT_ERRORS as e:
+                    delay = min(RETRY_BACKOFF * 2 ** attempt, MAX_RECONNECT_DELAY)
+                    attempt += 1
+                    print(f"Reconnecting {self.sensors[sensor_id][0]} failed ({e or type(e).__name__}), "
+                          f"retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            if self.on_reconnect is not None:
+                self.on_reconnect(sensor_id)
+        finally:
+            self._reconnecting.pop(sensor_id, None)
+
+    def _mark_streaming(self, sensor_id, arrival_ns):
+        self.first_sample_ms[sensor_id] = (arrival_ns - self._recording_started_ns.get(sensor_id, arrival_ns)) / 1e6
+        event = self._first_packet.get(sensor_id)
+        if event is not None:
+            event.set()
+
+    async def _consume(self, packets, sensor_id):
+        # One long lived consumer per sensor, packets are handled in the
+        # order they arrived
+        while True:
+            arrival_ns, data = await packets.get()
+            try:
+                if arrival_ns is None:
+                    # A marker, data says whether it follows a reconnect
+                    if self.on_resume is not None:
+                        self.on_resume(sensor_id, data)
+                else:
+                    self._handlers.get(sensor_id, self.on_packet)(arrival_ns, data, sensor_id)
+            except Exception as e:
+                print(f"Error handling data from {self.sensors[sensor_id][0]}: {e}")
+            finally:
+                packets.task_done()
+
+    async def _start_recording(self, sensor_ids, on_packet):
+        if on_packet is None:
+            on_packet = self.on_packet
+        started_ns = now_ns()
+        stop_requested = asyncio.Event()
+        for sensor_id in sensor_ids:
+            self._handlers[sensor_id] = on_packet
+            self._recording_started_ns[sensor_id] = started_ns
+            self._stop_requested[sensor_id] = stop_requested
+            self.first_sample_ms.pop(sensor_id, None)
+        connected = await self.connect(sensor_ids)
+        if stop_requested.is_set():
+            # Stopped while still connecting
+            connected = []
+        first_packet = {sensor_id: asyncio.Event() for sensor_id in connected}
+        self._first_packet.update(first_packet)
+        for sensor_id in connected:
+            self._queues[sensor_id].put_nowait((None, False))
+        self._routing = self._routing | frozenset(connected)
+        # Ready means every sensor has actually delivered data, not only that
+        # the connection is up. A stop ends the wait straight away.
+        if connected:
+            streaming = asyncio.ensure_future(asyncio.gather(*(event.wait() for event in first_packet.values())))
+            stopped = asyncio.ensure_future(stop_requested.wait())
+            await asyncio.wait((streaming, stopped), timeout=FIRST_SAMPLE_TIMEOUT,
+                               return_when=asyncio.FIRST_COMPLETED)
+            streaming.cancel()
+            stopped.cancel()
+        streaming = [sensor_id for sensor_id in sensor_ids if sensor_id in self.first_sample_ms]
+        return {
+            "connected": connected,
+            "streaming": streaming,
+            "ready": len(streaming) == len(sensor_ids),
+            "first_sample_ms": {sensor_id: self.first_sample_ms[sensor_id] for sensor_id in streaming},
+        }
+
+    def start_recording(self, sensor_ids, on_packet=None):
+        # Connects whatever is missing and starts routing packets, to
+        # on_packet if given (e.g. the recording's Session). The returned
+        # future resolves once every sensor is streaming (or the first sample
+        # timeout passed) to a dict with the connected and streaming sensor
+        # ids and each sensor's time to first sample in ms.
+        return self.submit(self._start_recording(list(sensor_ids), on_packet))
+
+    async def _stop_recording(self, requested_ns, sensor_ids):
+        # Routing is switched off in the same loop iteration the stop is
+        # handled, the packets that were already queued are still handled so
+        # nothing arrives after this returns
+        if sensor_ids is None:
+            sensor_ids = set(self._stop_requested) | self._routing
+        self._routing = self._routing - frozenset(sensor_ids)
+        for sensor_id in sensor_ids:
+            stop_requested = self._stop_requested.pop(sensor_id, None)
+            if stop_requested is not None:
+                stop_requested.set()
+        await asyncio.gather(*(self._queues[sensor_id].join() for sensor_id in sensor_ids if sensor_id in self._queues))
+        self.stop_latency_ms = (now_ns() - requested_ns) / 1e6
+        return self.stop_latency_ms
+
+    def stop_recording(self, sensor_ids=None, timeout=STOP_TIMEOUT):
+        # Blocks until the recording of sensor_ids (all of them if None) has
+        # stopped and every queued packet was handled, returns the stop
+        # latency in ms (None on timeout)
+        if sensor_ids is not None:
+            sensor_ids = list(sensor_ids)
+        future = self.submit(self._stop_recording(now_ns(), sensor_ids))
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            print(f"Stopping the recording took longer than {timeout}s")
+            return None
+
+    async def disconnect_all(self):
+        self._routing = frozenset()
+        for task in list(self._reconnecting.values()):
+            task.cancel()
+        for consumer in self._consumers.values():
+            consumer.cancel()
+        self._consumers.clear()
+        self._queues.clear()
+        clients, self.clients = self.clients, {}
+        await asyncio.gather(*(client.disconnect() for client in clients.values()), return_exceptions=True)
+
+    def shutdown(self, timeout=10.0):
+        if not self._thread.is_alive():
+            return
+        try:
+            self.submit(self.disconnect_all()).result(timeout)
+        except Exception as e:
+            print(f"Error disconnecting sensors: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
@@ -0,0 +1,73 @@
+class LineFramer:
+    # Splits the byte stream of one sensor's UART characteristic into
+    # newline terminated frames. Only the newly arrived bytes are scanned for
+    # a delimiter and the consumed prefix is dropped in place, so the work per
+    # notification is linear in the size of the notification.
+    __slots__ = ("_buffer", "_scan_from", "_resync", "bytes_received", "frames_emitted", "partial_carries",
+                 "skipped_bytes")
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scan_from = 0
+        self._resync = False
+        self.bytes_received = 0
+        self.frames_emitted = 0
+        self.partial_carries = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        self.bytes_received += len(data)
+        if self._resync:
+            # Joined mid-line, the bytes up to the first newline are the
+            # tail of a line that started before
+            end = data.find(b'\n')
+            if end == -1:
+                self.skipped_bytes += len(data)
+                return []
+            self.skipped_bytes += end + 1
+            data = data[end + 1:]
+            self._resync = False
+        buffer = self._buffer
+        buffer += data
+
+        frames = []
+        start = 0
+        end = buffer.find(b'\n', self._scan_from)
+        if end != -1:
+            with memoryview(buffer) as view:
+                while end != -1:
+                    # Tolerate CRLF line endings and skip blank lines
+                    stop = end - 1 if end > start and buffer[end - 1] == 0x0D else end
+                    if stop > start:
+                        frames.append(view[start:stop].tobytes())
+                    start = end + 1
+                    end = buffer.find(b'\n', start)
+            # Deleting from the front of a bytearray only moves the start
+            # pointer, the partial tail is not copied
+            del buffer[:start]
+
+        self._scan_from = len(buffer)
+        if buffer:
+            self.partial_carries += 1
+        self.frames_emitted += len(frames)
+        return frames
+
+    def reset(self):
+        self._buffer.clear()
+        self._scan_from = 0
+        self._resync = False
+
+    def resync(self):
+        # The stream is picked up wherever it is, drop everything up to the
+        # next newline instead of reporting the fragment as a bad frame
+        self.reset()
+        self._resync = True
+
+    def stats(self):
+        return {
+            "bytes": self.bytes_received,
+            "frames": self.frames_emitted,
+            "partial_carries": self.partial_carries,
+            "skipped_bytes": self.skipped_bytes,
+            "pending": len(self._buffer),
+        }
@@ -0,0 +1,141 @@
+import numpy as np
+
+# Edge Impulse expects a fixed sample rate, 100 Hz unless the exercise config
+# sets "rate_hz"
+DEFAULT_RATE_HZ = 100.0
+
+
+class FusionEngine:
+    # Resamples the per sensor ring buffers onto one fixed rate time grid.
+    # Output rows are produced up to the newest timestamp every sensor has
+    # reached, each sensor is linearly interpolated at the grid times. All
+    # samples are processed a block at a time, nothing is dropped or
+    # duplicated because one sensor streams faster than another.
+    #
+    # A sensor that disconnected is in a gap: the others keep producing rows
+    # and its columns are NaN from its last sample before the disconnect to
+    # its first sample after reconnecting. Gaps are listed in self.gaps.
+    def __init__(self, buffers, sensors, rate_hz=DEFAULT_RATE_HZ):
+        self.buffers = buffers
+        self.sensors = list(sensors)
+        self.rate_hz = float(rate_hz)
+        self.period = 1000.0 / self.rate_hz  # timestamps are in ms
+        self.channels = buffers[self.sensors[0]].channels
+        self.rows_emitted = 0
+        self.next_time = None
+        self._cursor = {sensor: 0 for sensor in self.sensors}
+        # Samples the ring buffers dropped before they were resampled
+        self.overwritten = {sensor: 0 for sensor in self.sensors}
+        self.gaps = []
+        self._open_gaps = {}
+        self._empty = np.empty(0), np.empty((0, self.width), dtype=np.float32)
+
+    @property
+    def width(self):
+        return self.channels * len(self.sensors)
+
+    def in_gap(self, sensor):
+        return sensor in self._open_gaps
+
+    def open_gaps(self):
+        return list(self._open_gaps)
+
+    def start_gap(self, sensor):
+        # The sensor disconnected, stop waiting for it
+        if sensor in self._open_gaps or sensor not in self._cursor:
+            return
+        gap = {"sensor": sensor, "start_ms": self._last_timestamp(sensor), "end_ms": None}
+        self.gaps.append(gap)
+        self._open_gaps[sensor] = gap
+
+    def end_gap(self, sensor, first_timestamp):
+        # Call with the first timestamp after the reconnect, before that
+        # sample is added to the sensor's buffer
+        gap = self._open_gaps.pop(sensor, None)
+        if gap is not None:
+            # Packets still queued at the disconnect may have come in since
+            gap["start_ms"] = self._last_timestamp(sensor)
+            gap["end_ms"] = float(first_timestamp)
+
+    def _last_timestamp(self, sensor):
+        buffer = self.buffers[sensor]
+        return buffer.last_timestamp() if buffer.total_written else None
+
+    def poll(self, min_rows=1):
+        # Returns (timestamps, values) for every grid point that can be
+        # interpolated now, values has shape (n, channels * len(sensors)).
+        # Nothing is returned until min_rows grid points are ready: the
+        # interpolation costs about the same for one row as for a hundred.
+        buffers = self.buffers
+        horizon = None
+        for sensor in self.sensors:
+            if sensor in self._open_gaps:
+                continue
+            buffer = buffers[sensor]
+            if buffer.total_written == 0:
+                return self._empty
+            last = buffer.last_timestamp()
+            if horizon is None or last < horizon:
+                horizon = last
+        if horizon is None:
+            return self._empty
+
+        if self.next_time is None:
+            # Start once every sensor has data so nothing is extrapolated
+            self.next_time = max(float(buffers[sensor].since(0)[0][0]) for sensor in self.sensors
+                                 if buffers[sensor].total_written)
+        if horizon < self.next_time + (min_rows - 1) * self.period:
+            return self._empty
+
+        count = int((horizon - self.next_time) // self.period) + 1
+        times = self.next_time + np.arange(count) * self.period
+        out = np.empty((count, self.width), dtype=np.float32)
+        self.next_time += count * self.period
+
+        for k, sensor in enumerate(self.sensors):
+            buffer = buffers[sensor]
+            columns = out[:, k * self.channels:(k + 1) * self.channels]
+            if buffer.total_written == 0:
+                columns[:] = np.nan
+                continue
+            cursor = self._cursor[sensor]
+            oldest = buffer.oldest_index()
+            if oldest > cursor:
+                self.overwritten[sensor] += oldest - cursor
+                cursor = oldest
+            timestamps, values = buffer.since(cursor)
+            columns[:] = interpolate(times, timestamps, values)
+            self._mask_gaps(sensor, times, timestamps, columns)
+            # Keep the last sample before the next grid point, it is the left
+            # neighbour of the next block
+            keep = int(np.searchsorted(timestamps, self.next_time, side='right')) - 1
+            self._cursor[sensor] = cursor + max(keep, 0)
+
+        self.rows_emitted += count
+        return times, out
+
+    def _mask_gaps(self, sensor, times, timestamps, columns):
+        # Never interpolate across a disconnect
+        for gap in self.gaps:
+            if gap["sensor"] != sensor:
+                continue
+            if gap["end_ms"] is None:
+                columns[times > timestamps[-1]] = np.nan
+            elif gap["end_ms"] > times[0] and (gap["start_ms"] is None or gap["start_ms"] < times[-1]):
+                start = -np.inf if gap["start_ms"] is None else gap["start_ms"]
+                columns[(times > start) & (times < gap["end_ms"])] = np.nan
+
+
+def interpolate(times, timestamps, values):
+    # Linear interpolation of every column of values at times, timestamps must
+    # be non decreasing. Points outside the sampled range are clamped.
+    last = len(timestamps) - 1
+    right = np.searchsorted(timestamps, times, side='right')
+    left = np.clip(right - 1, 0, last)
+    right = np.clip(right, 0, last)
+    t0 = timestamps[left]
+    span = timestamps[right] - t0
+    weight = np.divide(times - t0, span, out=np.zeros_like(times), where=span > 0)
+    np.clip(weight, 0.0, 1.0, out=weight)
+    v0 = values[left]
+    return v0 + (values[right] - v0) * weight[:, None].astype(values.dtype)
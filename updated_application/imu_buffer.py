@@ -0,0 +1,109 @@
+import numpy as np
+
+IMU_CHANNELS = 6
+DEFAULT_CAPACITY = 8192
+
+
+def _parse_block(block, count, channels):
+    # Converting the tokens one by one raises ValueError for anything that
+    # isn't a number, so a bad frame is never half parsed
+    values = np.array(block.split(b','), dtype=np.float32)
+    if values.size != count * channels:
+        raise ValueError(f"Expected {count * channels} values, got {values.size}")
+    return values.reshape(count, channels)
+
+
+def parse_frames(frames, channels=IMU_CHANNELS):
+    # Convert a batch of raw "ax,ay,az,gx,gy,gz" frames into a (n, channels)
+    # float32 array in one pass. Returns the array and a list of
+    # (index, frame, error message) tuples for the frames that were rejected,
+    # the rows of the array are the other frames in order.
+    separators = channels - 1
+    good = []
+    bad = []
+    for index, frame in enumerate(frames):
+        if frame.count(b',') == separators:
+            good.append((index, frame))
+        else:
+            bad.append((index, frame, f"Incorrect number of values: {frame.count(b',') + 1}"))
+    if not good:
+        return np.empty((0, channels), dtype=np.float32), bad
+    try:
+        return _parse_block(b','.join([frame for _, frame in good]), len(good), channels), bad
+    except ValueError:
+        pass
+
+    # Somewhere in the block is a malformed number, parse frame by frame to
+    # keep the good ones
+    parsed = []
+    for index, frame in good:
+        try:
+            parsed.append(_parse_block(frame, 1, channels))
+        except ValueError as e:
+            bad.append((index, frame, str(e)))
+    bad.sort()
+    if not parsed:
+        return np.empty((0, channels), dtype=np.float32), bad
+    return np.concatenate(parsed), bad
+
+
+class ImuRingBuffer:
+    # Preallocated per sensor storage for parsed samples. Samples are
+    # addressed by an absolute index that keeps growing, the ring position is
+    # that index modulo the capacity.
+    __slots__ = ("capacity", "channels", "values", "timestamps", "total_written")
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, channels=IMU_CHANNELS):
+        self.capacity = capacity
+        self.channels = channels
+        self.values = np.zeros((capacity, channels), dtype=np.float32)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.total_written = 0
+
+    def __len__(self):
+        return min(self.total_written, self.capacity)
+
+    def extend(self, values, timestamps):
+        # timestamps may be one value per sample or a single value shared by
+        # the whole batch
+        count = len(values)
+        if count == 0:
+            return
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64), (count,))
+        if count > self.capacity:
+            # Only the newest samples fit
+            values = values[-self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+            self.total_written += count - self.capacity
+            count = self.capacity
+        start = self.total_written % self.capacity
+        first = min(count, self.capacity - start)
+        self.values[start:start + first] = values[:first]
+        self.timestamps[start:start + first] = timestamps[:first]
+        if first < count:
+            self.values[:count - first] = values[first:]
+            self.timestamps[:count - first] = timestamps[first:]
+        self.total_written += count
+
+    def oldest_index(self):
+        return max(0, self.total_written - self.capacity)
+
+    def since(self, index):
+        # Samples written from absolute index onwards as (timestamps, values).
+        # Views into the ring are returned when the range does not wrap,
+        # otherwise the two halves are copied into a new array.
+        index = max(index, self.oldest_index())
+        count = self.total_written - index
+        if count <= 0:
+            return self.timestamps[:0], self.values[:0]
+        start = index % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            return self.timestamps[start:end], self.values[start:end]
+        end -= self.capacity
+        return (np.concatenate((self.timestamps[start:], self.timestamps[:end])),
+                np.concatenate((self.values[start:], self.values[:end])))
+
+    def last_timestamp(self):
+        # Timestamp of the newest sample, only valid once something was written
+        return float(self.timestamps[(self.total_written - 1) % self.capacity])
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+
+from timing import now_ns
+
+# Set to 1 to time every stage of the ingestion path
+ENV_VAR = "IMU_INSTRUMENT"
+PERF_DIRECTORY = "./perf"
+
+
+def instrumentation_enabled():
+    return os.environ.get(ENV_VAR, "") not in ("", "0")
+
+
+def percentile(values, fraction):
+    # Nearest rank percentile of a list of measurements, in any order
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class StageTimer:
+    # Durations of one stage in a power of two histogram: bucket k counts
+    # durations of 2**(k-1) to 2**k - 1 ns. Adding a duration is a few
+    # integer operations, no allocation.
+    __slots__ = ("count", "total_ns", "max_ns", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * 64
+
+    def add(self, duration_ns):
+        if duration_ns < 0:
+            # Replayed packets can be handled before their arrival time
+            duration_ns = 0
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        self.buckets[duration_ns.bit_length()] += 1
+
+    def percentile_ns(self, fraction):
+        # Upper edge of the bucket holding the percentile
+        wanted = fraction * self.count
+        seen = 0
+        for k, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return min(2 ** k - 1, self.max_ns)
+        return 0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_us": self.total_ns / self.count / 1e3 if self.count else 0.0,
+            "p50_us": self.percentile_ns(0.5) / 1e3,
+            "p90_us": self.percentile_ns(0.9) / 1e3,
+            "p99_us": self.percentile_ns(0.99) / 1e3,
+            "max_us": self.max_ns / 1e3,
+            "total_ms": self.total_ns / 1e6,
+            "histogram_us": {f"<{2 ** k / 1e3:g}": count for k, count in enumerate(self.buckets) if count},
+        }
+
+
+class Instrumentation:
+    # Stage timers and counters of one recording. Each stage is only timed
+    # from one thread (the BLE loop or the writer thread), so no locking.
+    #
+    #   started = now_ns()
+    #   ...
+    #   started = perf.lap("framing", started)
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.created = time.time()
+
+    def stage(self, name):
+        timer = self.stages.get(name)
+        if timer is None:
+            timer = self.stages[name] = StageTimer()
+        return timer
+
+    def add(self, name, duration_ns):
+        self.stage(name).add(duration_ns)
+
+    def lap(self, name, started_ns):
+        # Times name from started_ns to now and returns now, the start of
+        # the next stage
+        now = now_ns()
+        self.stage(name).add(now - started_ns)
+        return now
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self):
+        return {
+            "created": self.created,
+            "stages": {name: timer.to_dict() for name, timer in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def dump(self, name, directory=PERF_DIRECTORY, **extra):
+        # Writes <directory>/<name>.json and returns its path
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}.json")
+        with open(path, 'w') as f:
+            json.dump(dict(self.to_dict(), **extra), f, indent=2)
+        return path
@@ -1,166 +1,153 @@
+import time
+# Taken before the other imports for the startup report
+STARTUP_STARTED = time.perf_counter()
 import sys
-import os
-import csv
-import asyncio
 import json
-from datetime import datetime
-from bleak import BleakScanner, BleakClient
+import importlib
+import threading
 from PyQt5.QtWidgets import (QApplication, QWizard, QWizardPage, QLabel, QLineEdit, QVBoxLayout, QDateEdit, QPushButton, QComboBox, QMessageBox, QInputDialog)
-from PyQt5.QtCore import QDate, QThread, pyqtSignal, QTimer, QObject
-import hashlib
-import time
-import string
-import random
-
-# UUIDs and other data
-UART_SERVICE_UUIDS = [
-    ("Sense Right Hand", "8E400004-B5A3-F393-E0A9-E50E24DCCA9E", "8E400006-B5A3-F393-E0A9-E50E24DCCA9E"),
-    ("Sense Left Hand", "6E400001-B5A3-F393-E0A9-E50E24DCCA9E", "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"),
-    ("Sense Right Leg", "7E400001-A5B3-C393-D0E9-F50E24DCCA9E", "7E400003-A5B3-C393-D0E9-F50E24DCCA9E"),
-    ("Sense Left Leg", "6E400001-B5C3-D393-A0F9-E50F24DCCA9E", "6E400003-B5C3-D393-A0F9-E50F24DCCA9E")
-]
-buffers = {i: "" for i in range(1, 5)}
-start_times = {i: None for i in range(1, 5)}
-sensor_data = {i: {"timestamp": None, "values": [None] * 6} for i in range(1, 5)}
-csv_filename = ""
-STOP_FLAG = False
-error_counter = 0
-MAX_ERRORS = 4
-
-# Load exercise configuration from a JSON file
-with open('./updated_application/exercise_config.json') as f:
+from PyQt5.QtCore import QDate, QEvent, pyqtSignal, QTimer, QObject
+# numpy, bleak and the recording pipeline are imported on first use (see
+# preload_pipeline), the first window doesn't need them
+from app_paths import EXERCISE_CONFIG_PATH
+from ble_discovery import DeviceCache
+from stations import StationHub, load_stations, local_result
+from profiling import TakeProfiler, profile_mode
+from recording import (BASE_SENSORS, LABELS, append_to_exercise_record, get_saved_date_string,
+                       get_saved_school_name, new_exercise_record, save_date_string, save_school_name)
+IMPORTS_DONE = time.perf_counter()
+
+# Short sensor names for the rate line
+SENSOR_ABBREVIATIONS = {1: "RH", 2: "LH", 3: "RL", 4: "LL"}
+# Set from --profile / IMU_PROFILE, profiles every take
+take_profiler = None
+
+# Load exercise configuration from a JSON file shipped with the app
+with open(EXERCISE_CONFIG_PATH) as f:
     EXERCISE_CONFIG = json.load(f)
 
-def generate_hashed_id(info):
-    # Generate a random string
-    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-
-    # Get the current timestamp
-    timestamp = str(time.time())
-
-    # Combine the information with the random string and timestamp
-    input_str = f"{info}_{random_str}_{timestamp}"
-
-    # Generate the hash
-    hash_object = hashlib.sha256(input_str.encode('utf-8'))
-    return hash_object.hexdigest()[:20]  # Use the first 20 characters of the hash
-
-# Function to append the new record to the exercise JSON file
-def append_to_exercise_record(date, record):
-    filename = f'exercise_records_{date}.json'
-    try:
-        with open(filename, 'r') as f:
-            records = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        records = []
-
-    records.append(record)
-    with open(filename, 'w') as f:
-        json.dump(records, f, indent=4)
+# Imported by name in preload_pipeline, listed in new_application.spec's
+# hiddenimports for the same reason
+PIPELINE_MODULES = ("session", "rate_monitor", "connection_manager")
+
+def preload_pipeline():
+    # Imports the modules a recording needs, numpy and bleak included, so the
+    # first Start doesn't wait for them. Runs on its own thread once the
+    # first window has been painted.
+    started = time.perf_counter()
+    for module in PIPELINE_MODULES:
+        importlib.import_module(module)
+    print(f"Recording pipeline loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def startup_finished(app_created, first_paint):
+    print(f"Startup: imports {(IMPORTS_DONE - STARTUP_STARTED) * 1000:.0f} ms, "
+          f"QApplication {(app_created - STARTUP_STARTED) * 1000:.0f} ms, "
+          f"first window {(first_paint - STARTUP_STARTED) * 1000:.0f} ms")
+    threading.Thread(target=preload_pipeline, name="preload", daemon=True).start()
+
+class FirstPaint(QObject):
+    # Application wide event filter that waits for the first paint, reports
+    # the startup times once that paint is done and removes itself
+    def __init__(self, app, app_created):
+        super().__init__()
+        self.app = app
+        self.app_created = app_created
 
-# Define global variable for selected exercise configuration
-selected_exercise_config = None
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint:
+            self.app.removeEventFilter(self)
+            first_paint = time.perf_counter()
+            QTimer.singleShot(0, lambda: startup_finished(self.app_created, first_paint))
+        return False
 
 class GuiUpdater(QObject):
     showMessageSignal = pyqtSignal(str)
-    stopExerciseSignal = pyqtSignal()
+    stopExerciseSignal = pyqtSignal(str)
     stopForErrorsSignal = pyqtSignal(str)
 
-    def __init__(self):
-        super().__init__()
-
     def show_message(self, message):
-        msgBox = QMessageBox()
-        msgBox.setText(message)
-        msgBox.exec()
+        QMessageBox.information(None, "Info", message)
 
-    def stop_exercise(self):
-        ex.stopExercise()
+    def stop_exercise(self, station_name):
+        ex.stopExercise(station_name)
 
 gui_updater = GuiUpdater()
 gui_updater.showMessageSignal.connect(gui_updater.show_message)
 gui_updater.stopExerciseSignal.connect(gui_updater.stop_exercise)
 gui_updater.stopForErrorsSignal.connect(gui_updater.show_message)
 
-async def notification_handler(sender, data, sensor_id):
-    global buffers, start_times, STOP_FLAG, error_counter, selected_exercise_config
-    if STOP_FLAG:
-        return
-    if start_times[sensor_id] is None:
-        start_times[sensor_id] = datetime.now()
-    buffers[sensor_id] += data.decode('utf-8')
-    buffer = buffers[sensor_id]
-    while '\n' in buffer:
-        line, buffer = buffer.split('\n', 1)
-        buffers[sensor_id] = buffer
-        if line.strip() == "":
-            continue
-        try:
-            parts = line.split(',')
-            if len(parts) != 6:
-                raise ValueError(f"Incorrect number of values: {len(parts)}. Received line: {line}")
-            imu_values = list(map(float, parts))
-            elapsed_time = (datetime.now() - start_times[sensor_id]).total_seconds() * 1000
-            sensor_data[sensor_id]["timestamp"] = elapsed_time
-            sensor_data[sensor_id]["values"] = imu_values
-            if all(sensor_data[i]["timestamp"] is not None and sensor_data[i]["values"][0] is not None for i in selected_exercise_config["sensors"]):
-                timestamp = round(sensor_data[selected_exercise_config["sensors"][0]]["timestamp"], 3)
-                row = [timestamp] + sum((sensor_data[i]["values"] for i in selected_exercise_config["sensors"]), [])
-                if len(row) != len(selected_exercise_config["columns"]):
-                    raise ValueError("Row has an incorrect number of values")
-                with open(csv_filename, 'a', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(row)
-                for i in selected_exercise_config["sensors"]:
-                    sensor_data[i]["timestamp"] = None
-                    sensor_data[i]["values"] = [None] * 6
-        except ValueError as e:
-            error_counter += 1
-            print(f"Error: {e}. Received line: {line}")
-            if error_counter >= MAX_ERRORS:
-                QTimer.singleShot(0, gui_updater.stopExerciseSignal.emit)
-                QTimer.singleShot(0, lambda: gui_updater.stopForErrorsSignal.emit("Bad data, stop and restart"))
-
-async def connect_to_sensor(device, sensor_id, char_uuid):
-    async with BleakClient(device) as client:
-        if client.is_connected:
-            print(f"Connected to {device.name}")
-            await client.start_notify(char_uuid, lambda sender, data: asyncio.create_task(notification_handler(sender, data, sensor_id)))
-            while not STOP_FLAG:
-                await asyncio.sleep(0.5)
-
-async def scan_and_connect():
-    tasks = []
-    devices = await BleakScanner.discover()
-    connected_sensors = []
-    for sensor in selected_exercise_config["sensors"]:
-        name, service_uuid, char_uuid = UART_SERVICE_UUIDS[sensor-1]
-        for device in devices:
-            if device.name == name:
-                tasks.append(connect_to_sensor(device, sensor, char_uuid))
-                connected_sensors.append(name)
-                break
-    gui_updater.showMessageSignal.emit(f"Connected to: {', '.join(connected_sensors)}")
-    await asyncio.gather(*tasks)
-
-class AsyncRunner(QThread):
+def stop_for_errors(station_name, message):
+    # Called from the BLE thread, the signals are queued to the Qt thread
+    gui_updater.stopExerciseSignal.emit(station_name)
+    gui_updater.stopForErrorsSignal.emit(message)
+
+class AsyncRunner(QObject):
+    # Qt side of the StationHub, which keeps every station's sensors
+    # connected on one BLE thread for as long as the wizard is open
     updateStatus = pyqtSignal(str)
-    sensorsConnected = pyqtSignal()
+    sensorsConnected = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        device_cache = DeviceCache()
+        self.stations = load_stations(BASE_SENSORS, device_cache=device_cache)
+        self.device_cache = device_cache
+        self.hub = None
+
+    def station(self, name):
+        return next(station for station in self.stations if station.name == name)
+
+    def _status(self, station, message):
+        # Only name the station when there is more than one
+        if len(self.stations) > 1:
+            message = f"{station.name}: {message}"
+        self.updateStatus.emit(message)
+
+    def start(self, station, session):
+        if self.hub is None:
+            self.hub = StationHub(self.stations, self.device_cache, on_disconnect=self._sensor_disconnected,
+                                  on_reconnect=self._sensor_reconnected)
+        self._status(station, "Connecting to sensors...")
+        future = self.hub.start(station, session)
+        future.add_done_callback(lambda future: self._recording_started(station, session, future))
+
+    def _recording_started(self, station, session, future):
+        # Runs on the hub's thread, signals are queued to the Qt thread
+        try:
+            result = local_result(future.result())
+        except Exception as e:
+            self._status(station, f"Connecting to sensors failed: {e}")
+            return
+        for sensor, elapsed in result["first_sample_ms"].items():
+            print(f"{station.sensor_name(sensor)}: first sample after {elapsed:.0f} ms")
+        names = [station.sensor_name(sensor) for sensor in result["streaming"]]
+        gui_updater.showMessageSignal.emit(f"Connected to: {', '.join(names)}")
+        if result["ready"]:
+            self.sensorsConnected.emit(station.name)
+            self._status(station, "Sensors connected")
+        else:
+            missing = [station.sensor_name(sensor) for sensor in session.sensors
+                       if sensor not in result["streaming"]]
+            self._status(station, f"No data from: {', '.join(missing)}. Stop and try again")
+
+    def _sensor_disconnected(self, station, sensor_id):
+        # Called on the hub's thread
+        self._status(station, f"{station.sensor_name(sensor_id)} disconnected, reconnecting...")
 
-    async def scan_and_connect(self):
-        await scan_and_connect()
-        self.sensorsConnected.emit()
-        self.updateStatus.emit("Sensors connected")
+    def _sensor_reconnected(self, station, sensor_id):
+        self._status(station, f"{station.sensor_name(sensor_id)} reconnected")
 
-    def run(self):
-        global STOP_FLAG
-        STOP_FLAG = False
-        self.updateStatus.emit("Connecting to sensors...")
-        asyncio.run(self.scan_and_connect())
+    def stop(self, station):
+        # Returns the station's session, the time in ms it took until no more
+        # data was coming in and the recording's stats
+        if self.hub is None:
+            return station.finish(), None, station.stats()
+        return self.hub.stop(station)
 
-    def stop(self):
-        global STOP_FLAG
-        STOP_FLAG = True
+    def shutdown(self):
+        if self.hub is not None:
+            self.hub.shutdown()
+            self.hub = None
 
 class StartPage(QWizardPage):
     def __init__(self, parent=None):
@@ -188,28 +175,11 @@ class StartPage(QWizardPage):
         save_date(self.date_input.date())
         return True
 
-def save_school_name(name):
-    with open('school_name.txt', 'w') as f:
-        f.write(name)
-
-def get_saved_school_name():
-    try:
-        with open('school_name.txt', 'r') as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        return ""
-
 def save_date(date):
-    with open('date.txt', 'w') as f:
-        f.write(date.toString("yyyyMMdd"))
+    save_date_string(date.toString("yyyyMMdd"))
 
 def get_saved_date():
-    try:
-        with open('date.txt', 'r') as f:
-            date_str = f.read().strip()
-            return QDate.fromString(date_str, "yyyyMMdd")
-    except FileNotFoundError:
-        return QDate.currentDate()
+    return QDate.fromString(get_saved_date_string(), "yyyyMMdd")
 
 class MainPage(QWizardPage):
     def __init__(self, parent=None):
@@ -220,6 +190,18 @@ class MainPage(QWizardPage):
     def initUI(self):
         self.layout = QVBoxLayout()
         self.setFixedSize(500, 500)
+        self.async_runner = AsyncRunner()
+        self.async_runner.updateStatus.connect(self.setStatus)
+        self.async_runner.sensorsConnected.connect(self.start_timer)
+        # Only shown when stations.json sets up more than one sensor kit
+        self.station_label = QLabel("Station:")
+        self.station_dropdown = QComboBox()
+        self.station_dropdown.addItems([station.name for station in self.async_runner.stations])
+        self.station_dropdown.currentTextChanged.connect(self.stationChanged)
+        self.layout.addWidget(self.station_label)
+        self.layout.addWidget(self.station_dropdown)
+        self.station_label.setVisible(len(self.async_runner.stations) > 1)
+        self.station_dropdown.setVisible(len(self.async_runner.stations) > 1)
         self.grade_label = QLabel("Grade:")
         self.grade_input = QLineEdit()
         self.layout.addWidget(self.grade_label)
@@ -231,77 +213,91 @@ class MainPage(QWizardPage):
         self.layout.addWidget(self.exercise_name_dropdown)
         self.status_label = QLabel("")
         self.layout.addWidget(self.status_label)
+        # Live per sensor input and fused output rates while recording
+        self.rate_label = QLabel("")
+        self.layout.addWidget(self.rate_label)
         self.timer_label = QLabel("Elapsed Time: 0s")
         self.layout.addWidget(self.timer_label)
         self.start_button = QPushButton('Start Exercise', self)
         self.start_button.clicked.connect(self.startExercise)
         self.layout.addWidget(self.start_button)
         self.stop_button = QPushButton('Stop Exercise', self)
-        self.stop_button.clicked.connect(self.stopExercise)
+        self.stop_button.clicked.connect(lambda: self.stopExercise())
         self.stop_button.setEnabled(False)
         self.layout.addWidget(self.stop_button)
         self.setLayout(self.layout)
         self.timer = QTimer(self)
-        self.elapsed_time = 0
+        # Per station: seconds since the recording started and the record
+        # to append to the exercise log
+        self.elapsed_time = {}
+        self.exercise_records = {}
         self.timer.timeout.connect(self.update_timer)
-        self.async_runner = AsyncRunner()
-        self.async_runner.updateStatus.connect(self.setStatus)
-        self.async_runner.sensorsConnected.connect(self.start_timer)
+
+    def current_station(self):
+        return self.async_runner.station(self.station_dropdown.currentText())
+
+    def stationChanged(self, station_name):
+        recording = self.async_runner.station(station_name).recording
+        self.start_button.setEnabled(not recording)
+        self.stop_button.setEnabled(recording)
+        self.toggle_timer_label(recording)
+        self.timer_label.setText(f"Elapsed Time: {self.elapsed_time.get(station_name, 0)}s")
 
     def toggle_timer_label(self, show):
         self.timer_label.setVisible(show)
+        self.rate_label.setText("")
 
     def setStatus(self, status):
         self.status_label.setText(status)
 
     def startExercise(self):
-        global csv_filename, start_times, selected_exercise_config
-
+        station = self.current_station()
         exercise_name = self.exercise_name_dropdown.currentText()
-        selected_exercise_config = EXERCISE_CONFIG[exercise_name]
-        start_times = {i: None for i in selected_exercise_config["sensors"]}
 
-        self.start_timer()
+        self.start_timer(station.name)
         self.toggle_timer_label(True)
 
-        school_name = get_saved_school_name()
-        date_selected = get_saved_date().toString("yyyyMMdd")
-        grade = self.grade_input.text()
-
-        # Generate a unique hashed ID for the CSV file
-        hash_info = f"{school_name}_{date_selected}_{grade}_{exercise_name}"
-        hashed_id = generate_hashed_id(hash_info)
-
-        os.makedirs("./data", exist_ok=True)
-        csv_filename = f"./data/{hashed_id}.csv"
-        with open(csv_filename, 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(selected_exercise_config["columns"])
-
-        # Prepare record to later append to the exercise log
-        global exercise_record
-        exercise_record = {
-            "school_name": school_name,
-            "date": date_selected,
-            "grade": grade,
-            "exercise_name": exercise_name,
-            "file_id": hashed_id,
-            "label": None  # Initially, label is None
-        }
+        # Prepare record to later append to the exercise log, its hashed
+        # ID names the CSV file
+        record = new_exercise_record(get_saved_school_name(), get_saved_date().toString("yyyyMMdd"),
+                                     self.grade_input.text(), exercise_name)
+        if len(self.async_runner.stations) > 1:
+            record["station"] = station.name
+        self.exercise_records[station.name] = record
+        hashed_id = record["file_id"]
+
+        from session import Session
+        session = Session(exercise_name, EXERCISE_CONFIG[exercise_name], hashed_id, "./data",
+                          on_error_limit=lambda message: stop_for_errors(station.name, message))
 
         self.start_button.setEnabled(False)
         self.stop_button.setEnabled(True)
-        self.async_runner.start()
-
-    def stopExercise(self):
-        self.async_runner.stop()
-        self.async_runner.wait()
-        self.timer.stop()  # Ensure the timer stops here
-        exercise_name = self.exercise_name_dropdown.currentText()
+        self.async_runner.start(station, session)
+        if take_profiler is not None:
+            take_profiler.start(hashed_id, self.async_runner.hub.manager.loop)
+
+    def stopExercise(self, station_name=None):
+        station = self.current_station() if station_name is None else self.async_runner.station(station_name)
+        if not station.recording:
+            return
+        stop_started = time.perf_counter()
+        session, stop_latency_ms, stats = self.async_runner.stop(station)
+        if take_profiler is not None:
+            take_profiler.stop(session.file_id)
+        self.elapsed_time.pop(station.name, None)
+        if not self.elapsed_time:
+            self.timer.stop()  # Ensure the timer stops here
+        session.close(stop_latency_ms=stop_latency_ms, station=stats)
+        flushed_ms = (time.perf_counter() - stop_started) * 1000
+        print(f"Stopped receiving after {stop_latency_ms} ms, data flushed after {flushed_ms:.0f} ms")
+        print(f"Session writer: {session.metadata['writer']}")
+        print(f"{station.name}: {format_station_stats(stats)}")
+        exercise_record = self.exercise_records.pop(station.name)
 
         msgBox = QMessageBox(self)
         msgBox.setIcon(QMessageBox.Question)
-        msgBox.setText("Do you want to keep the data?")
+        msgBox.setText("Do you want to keep the data?" if len(self.async_runner.stations) == 1
+                       else f"Do you want to keep the data from {station.name}?")
         msgBox.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
         yesButton = msgBox.button(QMessageBox.Yes)
         msgBox.setDefaultButton(yesButton)
@@ -309,14 +305,11 @@ class MainPage(QWizardPage):
 
         if retval == QMessageBox.Yes:
             label, ok = QInputDialog.getItem(
-                self, 'Input Dialog', 'Enter a label for the data:', ["Good", "Idle", "Anomaly"], 0, False
+                self, 'Input Dialog', 'Enter a label for the data:', LABELS, 0, False
             )
             if ok:
-                global csv_filename, exercise_record
                 exercise_record["label"] = label  # Update the label in the record
-                base, ext = os.path.splitext(csv_filename)
-                new_filename = f"{base}_{exercise_name}{ext}"
-                os.rename(csv_filename, new_filename)
+                new_filename = session.keep()
 
                 # Append the record with the label to the exercise log
                 append_to_exercise_record(exercise_record["date"], exercise_record)
@@ -325,28 +318,52 @@ class MainPage(QWizardPage):
             else:
                 self.setStatus("Label input canceled")
         else:
-            os.remove(csv_filename)
+            session.discard()
             self.setStatus("Data discarded")
 
-        self.elapsed_time = 0
-        self.timer_label.setText("Elapsed Time: 0s")
-        self.toggle_timer_label(False)
-        self.start_button.setEnabled(True)
-        self.stop_button.setEnabled(False)
-        self.timer.stop()  # Ensure the timer stops here too
+        if station is self.current_station():
+            self.timer_label.setText("Elapsed Time: 0s")
+            self.toggle_timer_label(False)
+            self.start_button.setEnabled(True)
+            self.stop_button.setEnabled(False)
 
-    def start_timer(self):
-        self.elapsed_time = 0
-        self.timer.start(1000)
+    def start_timer(self, station_name):
+        self.elapsed_time[station_name] = 0
+        if not self.timer.isActive():
+            self.timer.start(1000)
         self.setStatus("Connected to sensors. Tracking exercises now.")
 
     def update_timer(self):
-        self.elapsed_time += 1
-        self.timer_label.setText(f"Elapsed Time: {self.elapsed_time}s")
-        if self.elapsed_time >= 6:
+        for station_name in self.elapsed_time:
+            self.elapsed_time[station_name] += 1
+        station = self.current_station()
+        if not station.recording:
+            return
+        elapsed_time = self.elapsed_time.get(station.name, 0)
+        self.timer_label.setText(f"Elapsed Time: {elapsed_time}s")
+        if len(self.async_runner.stations) > 1 and elapsed_time % 10 == 0:
+            for stats in self.async_runner.hub.stats():
+                if stats["recording"]:
+                    print(f"{stats['station']}: {format_station_stats(stats)}")
+        from rate_monitor import format_rates
+        session = station.session
+        self.rate_label.setText(format_rates(session.rate_snapshot(), SENSOR_ABBREVIATIONS))
+        writer_status = session.status()
+        reconnecting = session.fusion.open_gaps()
+        if reconnecting:
+            names = [station.sensor_name(sensor) for sensor in reconnecting]
+            self.setStatus(f"Reconnecting: {', '.join(names)}. Other sensors are still recording")
+        elif writer_status:
+            self.setStatus(writer_status)
+        elif elapsed_time >= 6:
             self.setStatus("Tracking exercises now...")
 
 
+def format_station_stats(stats):
+    return (f"{stats['packets_per_s']:.1f} packets/s, {stats['rows_per_s']:.1f} rows/s, "
+            f"{stats['bad_frames']} bad lines, {stats['dropped_rows']} rows dropped, {stats['gaps']} gaps")
+
+
 class ExerciseApp(QWizard):
     def __init__(self):
         super().__init__()
@@ -355,8 +372,11 @@ class ExerciseApp(QWizard):
         self.addPage(FinishPage())
         self.setWindowTitle("Exercise App")
     
-    def stopExercise(self):
-        self.findChild(MainPage).stopExercise()
+    def stopExercise(self, station_name=None):
+        self.findChild(MainPage).stopExercise(station_name)
+
+    def shutdown(self):
+        self.findChild(MainPage).async_runner.shutdown()
 
 class FinishPage(QWizardPage):
     def __init__(self, parent=None):
@@ -369,7 +389,14 @@ class FinishPage(QWizardPage):
         self.setLayout(layout)
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    mode, argv = profile_mode(sys.argv)
+    if mode is not None:
+        take_profiler = TakeProfiler(mode)
+    app = QApplication(argv)
+    app_created = time.perf_counter()
     ex = ExerciseApp()
+    app.aboutToQuit.connect(ex.shutdown)
+    first_paint = FirstPaint(app, app_created)
+    app.installEventFilter(first_paint)
     ex.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,183 @@
+import collections
+import cProfile
+import os
+import sys
+import threading
+import time
+
+# Profiling of collection runs, for takes where the UI freezes. Turned on
+# with --profile[=sample|cprofile] on the command line or IMU_PROFILE=sample
+# (or cprofile) in the environment, which also works for the frozen build.
+# Each take writes one profile per thread to ./profiles/<file_id>.<thread>.
+ENV_VAR = "IMU_PROFILE"
+FLAG = "--profile"
+MODES = ("sample", "cprofile")
+PROFILE_DIRECTORY = "./profiles"
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+# Thread name -> short name used in the profile file names
+PROFILED_THREADS = {"MainThread": "qt", "ble-connections": "ble"}
+
+
+def profile_mode(argv):
+    # Returns the requested mode or None and argv without the flag
+    mode = os.environ.get(ENV_VAR) or None
+    rest = []
+    for arg in argv:
+        if arg == FLAG:
+            mode = MODES[0]
+        elif arg.startswith(FLAG + "="):
+            mode = arg.split("=", 1)[1]
+        else:
+            rest.append(arg)
+    if mode is not None and mode not in MODES:
+        print(f"Unknown profile mode {mode!r}, using {MODES[0]}")
+        mode = MODES[0]
+    return mode, rest
+
+
+class SamplingProfiler:
+    # Samples the stacks of the given threads from a background thread with
+    # sys._current_frames(), so a thread stuck in a long call is still
+    # caught. Stacks are counted per thread and written in the collapsed
+    # "outer;inner count" format flame graph tools read.
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.threads = {}
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, threads):
+        # threads maps short name -> thread ident
+        self.threads = dict(threads)
+        self.stacks = {name: collections.Counter() for name in self.threads}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for name, ident in self.threads.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[name][_stack(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def write(self, prefix):
+        paths = []
+        for name, stacks in self.stacks.items():
+            path = f"{prefix}.{name}.folded"
+            with open(path, 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+        return paths
+
+
+def _stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class ThreadProfilers:
+    # One cProfile.Profile per thread. cProfile only sees the thread it was
+    # enabled on, so the BLE thread's profiler is switched on and off on its
+    # event loop. Python 3.12+ allows one active cProfile at a time, there
+    # only the first thread gets profiled.
+    def __init__(self):
+        self.profiles = {}
+
+    def start(self, loops):
+        # loops maps short name -> asyncio loop of that thread, None for the
+        # calling thread
+        for name, loop in loops.items():
+            profile = cProfile.Profile()
+            if _call_on(loop, profile.enable):
+                self.profiles[name] = (profile, loop)
+
+    def stop(self):
+        for profile, loop in self.profiles.values():
+            _call_on(loop, profile.disable)
+
+    def write(self, prefix):
+        paths = []
+        for name, (profile, _) in self.profiles.items():
+            path = f"{prefix}.{name}.prof"
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+
+def _call_on(loop, function, timeout=2.0):
+    # Runs function on loop's thread (or right here if loop is None),
+    # returns whether it succeeded
+    async def call():
+        function()
+
+    try:
+        if loop is None:
+            function()
+        else:
+            import asyncio
+            asyncio.run_coroutine_threadsafe(call(), loop).result(timeout)
+        return True
+    except Exception as e:
+        print(f"Profiler not started: {e}")
+        return False
+
+
+class TakeProfiler:
+    # Profiles one take at a time, from start() to stop()
+    def __init__(self, mode, directory=PROFILE_DIRECTORY):
+        self.mode = mode
+        self.directory = directory
+        self.file_id = None
+        self._profiler = None
+        self._started = None
+
+    @property
+    def active(self):
+        return self.file_id is not None
+
+    def start(self, file_id, ble_loop=None):
+        if self.active:
+            # Another station's take is being profiled already
+            return
+        self.file_id = file_id
+        self._started = time.perf_counter()
+        if self.mode == "cprofile":
+            loops = {"qt": None}
+            if ble_loop is not None:
+                loops["ble"] = ble_loop
+            self._profiler = ThreadProfilers()
+            self._profiler.start(loops)
+        else:
+            threads = {PROFILED_THREADS[thread.name]: thread.ident for thread in threading.enumerate()
+                       if thread.name in PROFILED_THREADS}
+            self._profiler = SamplingProfiler()
+            self._profiler.start(threads)
+
+    def stop(self, file_id):
+        # Writes the profiles of the take, returns their paths
+        if file_id != self.file_id:
+            return []
+        self._profiler.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        paths = self._profiler.write(os.path.join(self.directory, self.file_id))
+        print(f"Profiled {time.perf_counter() - self._started:.1f}s of {self.file_id} ({self.mode}): "
+              f"{', '.join(paths)}")
+        self.file_id = None
+        self._profiler = None
+        return paths
@@ -0,0 +1,89 @@
+import bisect
+
+from timing import now_ns
+
+# Upper edges of the packet inter-arrival histogram buckets, in ms
+INTER_ARRIVAL_EDGES_MS = (1, 2, 5, 10, 15, 20, 30, 50, 100, 200, 500)
+
+
+class RateMonitor:
+    # Counts what goes into and comes out of a recording: per sensor packets,
+    # samples and bad lines, samples overwritten in the ring buffers before
+    # the fusion got to them, and the fused rows. Updated on the BLE thread,
+    # snapshot() is read from the GUI thread and only looks at counters, so
+    # no locking is needed.
+    def __init__(self, sensors):
+        self.sensors = list(sensors)
+        self.packets = {sensor: 0 for sensor in self.sensors}
+        self.samples = {sensor: 0 for sensor in self.sensors}
+        self.bad_lines = {sensor: 0 for sensor in self.sensors}
+        # One count per edge plus one for longer gaps
+        self.inter_arrival = {sensor: [0] * (len(INTER_ARRIVAL_EDGES_MS) + 1) for sensor in self.sensors}
+        self.rows = 0
+        self.first_ns = None
+        self.last_ns = None
+        self._last_arrival = {}
+        self._previous = None
+
+    def packet(self, sensor_id, arrival_ns):
+        self.packets[sensor_id] += 1
+        if self.first_ns is None:
+            self.first_ns = arrival_ns
+        self.last_ns = arrival_ns
+        last = self._last_arrival.get(sensor_id)
+        self._last_arrival[sensor_id] = arrival_ns
+        if last is not None:
+            bucket = bisect.bisect_left(INTER_ARRIVAL_EDGES_MS, (arrival_ns - last) / 1e6)
+            self.inter_arrival[sensor_id][bucket] += 1
+
+    def parsed(self, sensor_id, samples, bad_lines):
+        self.samples[sensor_id] += samples
+        self.bad_lines[sensor_id] += bad_lines
+
+    def fused(self, rows):
+        self.rows += rows
+
+    def snapshot(self, overwritten=None):
+        # Rates since the previous snapshot (or the start), call from one
+        # thread only
+        now = now_ns()
+        totals = (now, dict(self.samples), self.rows)
+        previous = self._previous or (self.first_ns or now, {sensor: 0 for sensor in self.sensors}, 0)
+        self._previous = totals
+        elapsed = max((now - previous[0]) / 1e9, 1e-9)
+        return {
+            "input_hz": {sensor: (totals[1][sensor] - previous[1][sensor]) / elapsed for sensor in self.sensors},
+            "output_hz": (totals[2] - previous[2]) / elapsed,
+            "bad_lines": sum(self.bad_lines.values()),
+            "overwritten": sum(overwritten.values()) if overwritten else 0,
+        }
+
+    def summary(self, overwritten=None):
+        # Whole recording figures for the session metadata
+        duration = (self.last_ns - self.first_ns) / 1e9 if self.first_ns is not None else 0.0
+        per_second = 1 / duration if duration > 0 else 0.0
+        labels = [f"<{edge}ms" for edge in INTER_ARRIVAL_EDGES_MS] + [f">={INTER_ARRIVAL_EDGES_MS[-1]}ms"]
+        return {
+            "duration_s": duration,
+            "output_hz": self.rows * per_second,
+            "sensors": {
+                str(sensor): {
+                    "input_hz": self.samples[sensor] * per_second,
+                    "packets": self.packets[sensor],
+                    "samples": self.samples[sensor],
+                    "bad_lines": self.bad_lines[sensor],
+                    "overwritten": overwritten.get(sensor, 0) if overwritten else 0,
+                    "inter_arrival_ms": dict(zip(labels, self.inter_arrival[sensor])),
+                }
+                for sensor in self.sensors
+            },
+        }
+
+
+def format_rates(snapshot, names):
+    # One line for the status area, names maps sensor id -> short name
+    inputs = ", ".join(f"{names.get(sensor, sensor)} {hz:.0f}" for sensor, hz in snapshot["input_hz"].items())
+    text = f"In (Hz): {inputs} | Out: {snapshot['output_hz']:.0f} Hz"
+    if snapshot["bad_lines"] or snapshot["overwritten"]:
+        text += f" | {snapshot['bad_lines']} bad, {snapshot['overwritten']} overwritten"
+    return text
@@ -0,0 +1,157 @@
+import argparse
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from ble_discovery import DeviceCache
+from rate_monitor import format_rates
+from recording import (BASE_SENSORS, LABELS, append_to_exercise_record, get_saved_date_string,
+                       get_saved_school_name, new_exercise_record)
+from session import SESSION_FORMAT, Session
+from session_reader import load_exercise_config
+from stations import StationHub, load_stations, local_result
+
+# Headless recorder, the same connect/frame/parse/fuse/write pipeline as the
+# Qt wizard without importing PyQt5. Run from the directory the wizard runs
+# from (data/, the device cache and the catalog are relative to it):
+#
+#   python updated_application/recorder.py record --exercise "Skipping" --grade 3 --duration 30 --label Good
+STATUS_INTERVAL = 5.0  # seconds between status lines while recording
+
+
+def record(args):
+    exercise_config = load_exercise_config()
+    if args.exercise not in exercise_config:
+        print(f"Unknown exercise {args.exercise!r}, choose from: {', '.join(exercise_config)}")
+        return 2
+    config = exercise_config[args.exercise]
+
+    manager_options = {}
+    if args.simulate:
+        from ble_simulator import BleSimulator, SimulatedSensor
+        # Simulated addresses must not end up in the real device cache
+        device_cache = DeviceCache(os.path.join(tempfile.mkdtemp(), "sensor_devices.json"))
+    else:
+        device_cache = DeviceCache()
+    stations = load_stations(BASE_SENSORS, device_cache=device_cache)
+    names = [station.name for station in stations]
+    if args.station is None:
+        station = stations[0]
+    elif args.station in names:
+        station = stations[names.index(args.station)]
+    else:
+        print(f"Unknown station {args.station!r}, choose from: {', '.join(names)}")
+        return 2
+    if args.simulate:
+        simulator = BleSimulator([SimulatedSensor(name) for kit in stations for name, _ in kit.sensors.values()])
+        manager_options = {"client_class": simulator.client_class, "scanner_class": simulator.scanner_class}
+
+    exercise_record = new_exercise_record(args.school or get_saved_school_name(),
+                                          args.date or get_saved_date_string(), args.grade, args.exercise)
+    if len(stations) > 1:
+        exercise_record["station"] = station.name
+    sensor_names = {sensor: station.sensor_name(sensor) for sensor in station.sensors}
+    stop_requested = threading.Event()
+
+    def too_many_errors(message):
+        print(message)
+        stop_requested.set()
+
+    hub = StationHub(stations, device_cache, **manager_options)
+    session = Session(args.exercise, config, exercise_record["file_id"], args.output, session_format=args.format,
+                      on_error_limit=too_many_errors)
+
+    def give_up(message):
+        # Nothing usable was recorded, the session's files are removed
+        print(message)
+        hub.stop(station)
+        session.close()
+        session.discard()
+        return 1
+
+    # Ctrl+C ends the take early, the data recorded so far is kept
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_requested.set())
+    try:
+        print(f"Connecting to {', '.join(station.sensor_name(sensor) for sensor in session.sensors)}...")
+        try:
+            result = local_result(hub.start(station, session).result())
+        except Exception as e:
+            return give_up(f"Connecting to sensors failed: {e}")
+        missing = [station.sensor_name(sensor) for sensor in session.sensors if sensor not in result["streaming"]]
+        if missing:
+            # Rows need every sensor of the exercise, like in the wizard the
+            # take can't go ahead without one
+            return give_up(f"No data from: {', '.join(missing)}, giving up")
+        print(f"Recording {args.exercise} for {args.duration:g}s")
+        started = time.perf_counter()
+        deadline = started + args.duration
+        next_status = started + STATUS_INTERVAL
+        while not stop_requested.wait(max(min(deadline, next_status) - time.perf_counter(), 0)):
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now >= next_status:
+                next_status += STATUS_INTERVAL
+                status = session.status()
+                print(f"{now - started:5.0f}s {format_rates(session.rate_snapshot(), sensor_names)}"
+                      f"{' | ' + status if status else ''}")
+        _, stop_latency_ms, stats = hub.stop(station)
+    finally:
+        hub.shutdown()
+    session.close(stop_latency_ms=stop_latency_ms, station=stats)
+    print(f"Session writer: {session.metadata['writer']}")
+
+    if args.discard:
+        session.discard()
+        print("Data discarded")
+        return 0
+    exercise_record["label"] = args.label
+    new_filename = session.keep()
+    append_to_exercise_record(exercise_record["date"], exercise_record)
+    print(f"Data labeled as {args.label} and saved to {new_filename}")
+    return 0
+
+
+def replay(args):
+    from replay import main as replay_main
+    argv = list(args.files) + ["--speed", str(args.speed), "--output", args.output, "--format", args.format]
+    replay_main(argv)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record exercises without the GUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record one take")
+    record_parser.add_argument("--exercise", required=True, help="exercise name from exercise_config.json")
+    record_parser.add_argument("--grade", required=True)
+    record_parser.add_argument("--duration", type=float, default=30.0, help="seconds to record")
+    record_parser.add_argument("--school", help="school name, default the one saved by the wizard")
+    record_parser.add_argument("--date", help="yyyyMMdd, default the one saved by the wizard or today")
+    # Like the wizard, a take is either labeled and kept or discarded
+    keep_or_discard = record_parser.add_mutually_exclusive_group(required=True)
+    keep_or_discard.add_argument("--label", choices=LABELS, help="label stored with the take")
+    keep_or_discard.add_argument("--discard", action="store_true", help="don't keep the data (e.g. a dry run)")
+    record_parser.add_argument("--station", help="station from stations.json, default the first")
+    record_parser.add_argument("--output", default="./data", help="directory for the session files")
+    record_parser.add_argument("--format", choices=["csv", "binary"], default=SESSION_FORMAT)
+    record_parser.add_argument("--simulate", action="store_true", help="use simulated sensors instead of BLE")
+    record_parser.set_defaults(handler=record)
+
+    replay_parser = commands.add_parser("replay", help="reprocess recorded sessions")
+    replay_parser.add_argument("files", nargs="+")
+    replay_parser.add_argument("--speed", type=float, default=0.0)
+    replay_parser.add_argument("--output", default="./reprocessed")
+    replay_parser.add_argument("--format", choices=["csv", "binary"], default="csv")
+    replay_parser.set_defaults(handler=replay)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
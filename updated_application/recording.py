@@ -0,0 +1,85 @@
+import hashlib
+import random
+import string
+import time
+
+from session_catalog import open_catalog
+
+# Shared by the Qt wizard and the headless recorder, nothing here imports
+# PyQt5
+
+# UUIDs and other data
+UART_SERVICE_UUIDS = [
+    ("Sense Right Hand", "8E400004-B5A3-F393-E0A9-E50E24DCCA9E", "8E400006-B5A3-F393-E0A9-E50E24DCCA9E"),
+    ("Sense Left Hand", "6E400001-B5A3-F393-E0A9-E50E24DCCA9E", "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"),
+    ("Sense Right Leg", "7E400001-A5B3-C393-D0E9-F50E24DCCA9E", "7E400003-A5B3-C393-D0E9-F50E24DCCA9E"),
+    ("Sense Left Leg", "6E400001-B5C3-D393-A0F9-E50F24DCCA9E", "6E400003-B5C3-D393-A0F9-E50F24DCCA9E")
+]
+BASE_SENSORS = {i + 1: (name, char_uuid) for i, (name, service_uuid, char_uuid) in enumerate(UART_SERVICE_UUIDS)}
+LABELS = ["Good", "Idle", "Anomaly"]
+DATE_FORMAT = "%Y%m%d"  # yyyyMMdd, as in the file names and records
+session_catalog = None
+
+
+def generate_hashed_id(info):
+    # Generate a random string
+    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+
+    # Get the current timestamp
+    timestamp = str(time.time())
+
+    # Combine the information with the random string and timestamp
+    input_str = f"{info}_{random_str}_{timestamp}"
+
+    # Generate the hash
+    hash_object = hashlib.sha256(input_str.encode('utf-8'))
+    return hash_object.hexdigest()[:20]  # Use the first 20 characters of the hash
+
+
+def new_exercise_record(school_name, date, grade, exercise_name):
+    # The record appended to the exercise log for a take, its file_id names
+    # the session file
+    hash_info = f"{school_name}_{date}_{grade}_{exercise_name}"
+    return {
+        "school_name": school_name,
+        "date": date,
+        "grade": grade,
+        "exercise_name": exercise_name,
+        "file_id": generate_hashed_id(hash_info),
+        "label": None  # Initially, label is None
+    }
+
+
+# Function to append the new record to the session catalog
+def append_to_exercise_record(date, record):
+    global session_catalog
+    if session_catalog is None:
+        session_catalog = open_catalog()
+    session_catalog.add(dict(record, date=record.get("date", date)))
+
+
+def save_school_name(name):
+    with open('school_name.txt', 'w') as f:
+        f.write(name)
+
+
+def get_saved_school_name():
+    try:
+        with open('school_name.txt', 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def save_date_string(date):
+    with open('date.txt', 'w') as f:
+        f.write(date)
+
+
+def get_saved_date_string():
+    # The saved date as yyyyMMdd, today if none was saved
+    try:
+        with open('date.txt', 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return time.strftime(DATE_FORMAT)
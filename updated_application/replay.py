@@ -0,0 +1,138 @@
+import argparse
+import heapq
+import os
+import time
+
+import numpy as np
+
+from binary_session import BINARY_EXTENSION
+from ble_simulator import DEFAULT_INTERVAL_MS, DEFAULT_MTU
+from session import Session
+from session_reader import load_exercise_config, open_session
+from session_writer import metadata_filename
+from timing import now_ns
+
+# Column prefix of each sensor id in the recorded CSVs
+SENSOR_PREFIXES = {1: "right_hand", 2: "left_hand", 3: "right_leg", 4: "left_leg"}
+
+
+def recorded_config(recorded, exercise_config):
+    # The exercise config of a recording, rebuilt from its columns when the
+    # exercise isn't in exercise_config.json (e.g. "Squat")
+    config = exercise_config.get(recorded.exercise_name)
+    if config is not None and len(config["columns"]) == len(recorded.columns):
+        return config
+    sensors = [sensor for sensor, prefix in SENSOR_PREFIXES.items()
+               if any(column.startswith(prefix + "_") for column in recorded.columns)]
+    if len(recorded.columns) != 1 + 6 * len(sensors):
+        raise ValueError(f"Can't tell the sensors of {recorded.path} from its columns")
+    return {"sensors": sensors, "columns": list(recorded.columns)}
+
+
+def sensor_packets(timestamps_ms, values, mtu=DEFAULT_MTU, interval_ms=DEFAULT_INTERVAL_MS):
+    # One sensor's samples as the UART notifications it would have sent:
+    # the lines due by each connection interval go out in chunks of at most
+    # mtu bytes. Yields (offset_ns, packet) from the first sample. Samples
+    # with NaNs (a disconnect in the recording) are left out.
+    if not len(timestamps_ms):
+        return
+    start_ms = float(timestamps_ms[0])
+    pending = bytearray()
+    event_ms = start_ms
+    for timestamp, row in zip(timestamps_ms, values):
+        while timestamp > event_ms:
+            yield from _chunks(pending, (event_ms - start_ms) * 1e6, mtu)
+            event_ms += interval_ms
+        if not np.isnan(row).any():
+            pending += ("%.4f,%.4f,%.4f,%.4f,%.4f,%.4f\n" % tuple(row)).encode()
+    yield from _chunks(pending, (event_ms - start_ms) * 1e6, mtu)
+
+
+def _chunks(pending, offset_ns, mtu):
+    while pending:
+        yield int(offset_ns), bytes(pending[:mtu])
+        del pending[:mtu]
+
+
+def session_packets(recorded, sensors, mtu=DEFAULT_MTU, interval_ms=DEFAULT_INTERVAL_MS):
+    # Every sensor's packets merged in time order, as (offset_ns, sensor_id,
+    # packet). sensors are the recording's sensor ids in column order.
+    array = recorded.array()
+    timestamps = array[:, 0].astype(np.float64)
+    streams = []
+    for k, sensor_id in enumerate(sensors):
+        values = array[:, 1 + 6 * k:7 + 6 * k]
+        streams.append([(offset_ns, sensor_id, packet)
+                        for offset_ns, packet in sensor_packets(timestamps, values, mtu, interval_ms)])
+    return list(heapq.merge(*streams, key=lambda item: item[0]))
+
+
+def paced(packets, speed, started_ns):
+    # Hands out (offset_ns, sensor_id, packet) items as (arrival_ns,
+    # sensor_id, packet, lag_ns) at speed times real time from started_ns, 0
+    # doesn't wait. arrival_ns is started_ns plus the recorded offset, lag_ns
+    # how far behind schedule the item is handed out.
+    for offset_ns, sensor_id, packet in packets:
+        lag_ns = 0
+        if speed:
+            delay_ns = started_ns + offset_ns / speed - now_ns()
+            if delay_ns > 0:
+                time.sleep(delay_ns / 1e9)
+            else:
+                lag_ns = -delay_ns
+        yield started_ns + offset_ns, sensor_id, packet, lag_ns
+
+
+def replay(packets, on_packet, speed=10.0):
+    # Feeds the packets to on_packet(arrival_ns, data, sensor_id), the same
+    # handler path as live notifications, at speed times real time (0 as
+    # fast as possible). The arrival times are the recorded ones, so the
+    # result doesn't depend on the speed.
+    started = now_ns()
+    for arrival_ns, sensor_id, packet, _ in paced(packets, speed, started):
+        on_packet(arrival_ns, packet, sensor_id)
+    return (now_ns() - started) / 1e6
+
+
+def reprocess(path, directory="./reprocessed", speed=0.0, session_format="csv", exercise_config=None):
+    # Runs a recorded session through the current framing, timing and fusion
+    # into a new session file. Returns the new session's metadata. The
+    # output is named after the source, so it never goes into the source's
+    # directory and never replaces an existing file.
+    if os.path.realpath(directory) == os.path.dirname(os.path.realpath(path)):
+        raise ValueError(f"{directory} holds the recording itself, reprocess into another directory")
+    file_id = os.path.splitext(os.path.basename(path))[0]
+    filename = os.path.join(directory, file_id + (BINARY_EXTENSION if session_format == "binary" else ".csv"))
+    for existing in (filename, metadata_filename(filename)):
+        if os.path.exists(existing):
+            raise ValueError(f"{existing} already exists, not overwriting it")
+    if exercise_config is None:
+        exercise_config = load_exercise_config()
+    recorded = open_session(path, exercise_config)
+    config = recorded_config(recorded, exercise_config)
+    session = Session(recorded.exercise_name or "Unknown", config, file_id, directory, session_format=session_format)
+    replay_ms = replay(session_packets(recorded, config["sensors"]), session.handle_packet, speed)
+    return session.close(source=os.path.basename(path), replay_ms=replay_ms, replay_speed=speed,
+                         source_rows=len(recorded))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded sessions through the ingestion pipeline")
+    parser.add_argument("files", nargs="+", help="recorded sessions (.csv or .imu)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="real time multiplier, 0 (default) replays as fast as possible")
+    parser.add_argument("--output", default="./reprocessed", help="directory for the reprocessed sessions")
+    parser.add_argument("--format", choices=["csv", "binary"], default="csv", help="session file format")
+    args = parser.parse_args(argv)
+    for path in args.files:
+        try:
+            metadata = reprocess(path, args.output, args.speed, args.format)
+        except ValueError as e:
+            print(f"{path}: {e}")
+            continue
+        print(f"{path}: {metadata['source_rows']} rows in, {metadata['rows']} rows out at "
+              f"{metadata['rate_hz']:g} Hz in {metadata['replay_ms']:.0f} ms ({metadata['errors']} bad lines)")
+
+
+if __name__ == "__main__":
+    main()
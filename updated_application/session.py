@@ -0,0 +1,225 @@
+import os
+import time
+
+import numpy as np
+
+from framing import LineFramer
+from imu_buffer import ImuRingBuffer, parse_frames
+from fusion import DEFAULT_RATE_HZ, FusionEngine
+from rate_monitor import RateMonitor
+from instrumentation import Instrumentation, instrumentation_enabled
+from timing import PacketTimestamper, SessionClock, now_ns
+from session_writer import SessionWriter, ThreadedSessionWriter, metadata_filename, write_metadata
+from binary_session import BINARY_EXTENSION, BinarySessionWriter, convert_to_csv
+
+MAX_ERRORS = 4
+# Frames are collected per sensor and parsed, timestamped and fused together
+# once this much arrival time has passed, most notifications carry one frame
+# or none and numpy only pays off on a batch
+BATCH_INTERVAL_NS = 100_000_000
+# Fused rows are produced in blocks of at least this many grid points (100 ms
+# at 100 Hz), the rest is flushed when the session closes
+FUSION_BLOCK_ROWS = 10
+# "csv" writes the session CSV directly, "binary" records float32 records
+# and converts them to CSV when the take is kept
+SESSION_FORMAT = "csv"
+
+
+class Session:
+    # Everything that belongs to one recording: the per sensor framing,
+    # timing and sample buffers, the fusion and the writer. The packet and
+    # connection callbacks run on the BLE thread, so nothing here is shared
+    # with another recording and several sessions can run side by side.
+    __slots__ = (
+        "exercise_name", "config", "sensors", "file_id", "filename", "clock", "framers", "timestampers",
+        "buffers", "fusion", "rates", "perf", "writer", "error_count", "max_errors", "on_error_limit", "metadata",
+        "_reconnected", "_frames", "_arrivals", "_batch_due_ns",
+    )
+
+    def __init__(self, exercise_name, config, file_id, directory="./data", session_format=SESSION_FORMAT,
+                 max_errors=MAX_ERRORS, on_error_limit=None, instrument=None):
+        self.exercise_name = exercise_name
+        self.config = config
+        self.sensors = list(config["sensors"])
+        self.file_id = file_id
+        self.max_errors = max_errors
+        self.on_error_limit = on_error_limit
+        self.error_count = 0
+        self.metadata = None
+        self._reconnected = set()
+        # Frames waiting for the next batch, and (arrival, frame count) of
+        # the packets they came in
+        self._frames = {sensor: [] for sensor in self.sensors}
+        self._arrivals = {sensor: [] for sensor in self.sensors}
+        self._batch_due_ns = None
+
+        # One epoch for all sensors so their timestamps line up, it starts
+        # with the first notification
+        self.clock = SessionClock()
+        self.framers = {sensor: LineFramer() for sensor in self.sensors}
+        self.timestampers = {sensor: PacketTimestamper(self.clock) for sensor in self.sensors}
+        self.buffers = {sensor: ImuRingBuffer() for sensor in self.sensors}
+        self.fusion = FusionEngine(self.buffers, self.sensors, config.get("rate_hz", DEFAULT_RATE_HZ))
+        self.rates = RateMonitor(self.sensors)
+        # Stage timers, off unless asked for or IMU_INSTRUMENT is set
+        if instrument is None:
+            instrument = instrumentation_enabled()
+        self.perf = Instrumentation() if instrument else None
+
+        os.makedirs(directory, exist_ok=True)
+        if session_format == "binary":
+            self.filename = os.path.join(directory, f"{file_id}{BINARY_EXTENSION}")
+            writer = BinarySessionWriter(self.filename, config["columns"], sensors=self.sensors,
+                                         rate_hz=self.fusion.rate_hz,
+                                         metadata={"exercise_name": exercise_name, "file_id": file_id})
+        else:
+            self.filename = os.path.join(directory, f"{file_id}.csv")
+            writer = SessionWriter(self.filename, config["columns"])
+        self.writer = ThreadedSessionWriter(writer, perf=self.perf)
+
+    def handle_packet(self, arrival_ns, data, sensor_id):
+        perf = self.perf
+        if perf is not None:
+            started = now_ns()
+            # Time spent queued on the BLE loop before the handler ran
+            perf.add("queue", started - arrival_ns)
+            perf.count("packets")
+            perf.count("bytes", len(data))
+        self.rates.packet(sensor_id, arrival_ns)
+        frames = self.framers[sensor_id].feed(data)
+        if perf is not None:
+            perf.lap("framing", started)
+        if frames:
+            if self.clock.epoch_ns is None:
+                self.clock.start(arrival_ns)
+            self._frames[sensor_id] += frames
+            self._arrivals[sensor_id].append((arrival_ns, len(frames)))
+        if self._batch_due_ns is None:
+            self._batch_due_ns = arrival_ns + BATCH_INTERVAL_NS
+        elif arrival_ns >= self._batch_due_ns:
+            self._batch_due_ns = arrival_ns + BATCH_INTERVAL_NS
+            self.process_batch()
+
+    def process_batch(self, min_rows=FUSION_BLOCK_ROWS):
+        # Parses and timestamps the collected frames of every sensor into its
+        # ring buffer, then fuses and submits the rows that are ready
+        perf = self.perf
+        if perf is not None:
+            batch_started = started = now_ns()
+            perf.count("batches")
+        for sensor_id, frames in self._frames.items():
+            if not frames:
+                continue
+            arrivals = self._arrivals[sensor_id]
+            self._frames[sensor_id] = []
+            self._arrivals[sensor_id] = []
+            imu_values, bad_frames = parse_frames(frames)
+            if perf is not None:
+                started = perf.lap("parse", started)
+                perf.count("frames", len(frames))
+                perf.count("bad_frames", len(bad_frames))
+            self.rates.parsed(sensor_id, len(imu_values), len(bad_frames))
+            for _, line, reason in bad_frames:
+                self.error_count += 1
+                print(f"Error: {reason}. Received line: {line}")
+                if self.error_count == self.max_errors and self.on_error_limit is not None:
+                    self.on_error_limit("Bad data, stop and restart")
+            if len(imu_values) == 0:
+                continue
+            arrival_ns, counts = zip(*arrivals)
+            timestamps = self.timestampers[sensor_id].stamp_packets(arrival_ns, counts)
+            if bad_frames:
+                # A rejected frame still took its place in the packet
+                timestamps = np.delete(timestamps, [index for index, _, _ in bad_frames])
+            if sensor_id in self._reconnected:
+                # First data after a reconnect closes the sensor's gap
+                self._reconnected.discard(sensor_id)
+                self.fusion.end_gap(sensor_id, timestamps[0])
+            self.buffers[sensor_id].extend(imu_values, timestamps)
+            if perf is not None:
+                started = perf.lap("timestamp", started)
+
+        timestamps, values = self.fusion.poll(min_rows)
+        if perf is not None:
+            started = perf.lap("fuse", started)
+        if len(timestamps):
+            self.rates.fused(len(timestamps))
+            self.writer.submit_block(timestamps, values)
+            if perf is not None:
+                perf.lap("submit", started)
+                perf.count("rows", len(timestamps))
+        if perf is not None:
+            perf.add("batch", now_ns() - batch_started)
+
+    def sensor_disconnected(self, sensor_id):
+        # The other sensors keep recording. The frames that came in before
+        # the disconnect go into the buffers first, the gap starts after them.
+        self.process_batch()
+        self.fusion.start_gap(sensor_id)
+
+    def sensor_resumed(self, sensor_id, reconnected):
+        # Call in order with the packets, before the first packet of a new
+        # connection (reconnected) or of the recording. After a reconnect the
+        # frames from before the disconnect go into the buffers and the
+        # partial line is dropped. A recording joins a stream that is already
+        # running, the fragment it starts with isn't a bad frame.
+        if not reconnected:
+            self.framers[sensor_id].resync()
+            return
+        self.process_batch()
+        self.framers[sensor_id].reset()
+        if self.fusion.in_gap(sensor_id):
+            self._reconnected.add(sensor_id)
+
+    def status(self):
+        return self.writer.status()
+
+    def rate_snapshot(self):
+        # Live input/output rates since the previous call, for the GUI
+        return self.rates.snapshot(self.fusion.overwritten)
+
+    def close(self, **extra):
+        # Flushes and closes the session file and writes its metadata, call
+        # once no more packets are coming in
+        close_started = time.perf_counter()
+        # The frames and rows short of a full batch
+        self.process_batch(min_rows=1)
+        self.writer.close()
+        close_ms = (time.perf_counter() - close_started) * 1000
+        self.metadata = {
+            "file_id": self.file_id,
+            "exercise_name": self.exercise_name,
+            "columns": self.config["columns"],
+            "sensors": self.sensors,
+            "rate_hz": self.fusion.rate_hz,
+            "rows": self.fusion.rows_emitted,
+            "gaps": self.fusion.gaps,
+            "errors": self.error_count,
+            "writer": self.writer.summary(),
+            "rates": self.rates.summary(self.fusion.overwritten),
+            "close_ms": close_ms,
+        }
+        self.metadata.update(extra)
+        write_metadata(self.filename, self.metadata)
+        if self.perf is not None:
+            # Kept apart from the data so it survives discarding the take
+            path = self.perf.dump(self.file_id, exercise_name=self.exercise_name, file_id=self.file_id)
+            print(f"Instrumentation written to {path}")
+        return self.metadata
+
+    def keep(self):
+        # Renames the files to <file_id>_<exercise name>, exporting the CSV
+        # for binary sessions. Returns the CSV filename.
+        base, ext = os.path.splitext(self.filename)
+        new_filename = f"{base}_{self.exercise_name}{ext}"
+        os.rename(self.filename, new_filename)
+        os.rename(metadata_filename(self.filename), metadata_filename(new_filename))
+        self.filename = new_filename
+        if ext == BINARY_EXTENSION:
+            # Keep the binary recording and export the CSV next to it
+            return convert_to_csv(new_filename)
+        return new_filename
+
+    def discard(self):
+        os.remove(self.filename)
+        os.remove(metadata_filename(self.filename))
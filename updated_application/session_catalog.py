@@ -0,0 +1,129 @@
+import glob
+import json
+import os
+import sqlite3
+import time
+
+CATALOG_FILENAME = 'exercise_records.db'
+INDEXED_FIELDS = ("school_name", "date", "grade", "exercise_name", "label")
+RECORD_FIELDS = ("file_id",) + INDEXED_FIELDS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    file_id TEXT PRIMARY KEY,
+    school_name TEXT,
+    date TEXT,
+    grade TEXT,
+    exercise_name TEXT,
+    label TEXT,
+    created REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_school ON sessions (school_name);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+CREATE INDEX IF NOT EXISTS sessions_grade ON sessions (grade);
+CREATE INDEX IF NOT EXISTS sessions_exercise ON sessions (exercise_name, label, grade);
+CREATE INDEX IF NOT EXISTS sessions_label ON sessions (label);
+"""
+
+
+class SessionCatalog:
+    # Index of every kept take, keyed by file_id. Appending a record is a
+    # single insert and the journal keeps the file consistent if the laptop
+    # dies mid write, unlike rewriting exercise_records_<date>.json.
+    def __init__(self, path=CATALOG_FILENAME):
+        self.path = path
+        self.created = not os.path.exists(path)
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, record):
+        # Inserts the record, or replaces the one with the same file_id
+        with self._db:
+            self._insert(record)
+
+    def _insert(self, record):
+        # Fields outside the indexed set are kept as JSON
+        extra = {key: value for key, value in record.items() if key not in RECORD_FIELDS}
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [record["file_id"]] + [record.get(field) for field in INDEXED_FIELDS]
+            + [extra.pop("created", time.time()), json.dumps(extra) if extra else None],
+        )
+
+    def set_label(self, file_id, label):
+        with self._db:
+            self._db.execute("UPDATE sessions SET label = ? WHERE file_id = ?", (label, file_id))
+
+    def remove(self, file_id):
+        with self._db:
+            self._db.execute("DELETE FROM sessions WHERE file_id = ?", (file_id,))
+
+    def get(self, file_id):
+        row = self._db.execute("SELECT * FROM sessions WHERE file_id = ?", (file_id,)).fetchone()
+        return self._to_record(row) if row is not None else None
+
+    def query(self, **filters):
+        # e.g. query(exercise_name="Skipping", label="Good", grade="3"),
+        # only the indexed fields can be filtered on
+        where, params = self._where(filters)
+        rows = self._db.execute(f"SELECT * FROM sessions{where} ORDER BY created", params)
+        return [self._to_record(row) for row in rows]
+
+    def count(self, **filters):
+        where, params = self._where(filters)
+        return self._db.execute(f"SELECT COUNT(*) FROM sessions{where}", params).fetchone()[0]
+
+    @staticmethod
+    def _where(filters):
+        unknown = set(filters) - set(INDEXED_FIELDS)
+        if unknown:
+            raise ValueError(f"Can't filter sessions on {', '.join(sorted(unknown))}")
+        if not filters:
+            return "", ()
+        return " WHERE " + " AND ".join(f"{field} = ?" for field in filters), tuple(filters.values())
+
+    def import_json(self, path):
+        # Loads a legacy exercise_records_<date>.json file
+        try:
+            with open(path) as f:
+                records = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return 0
+        created = os.path.getmtime(path)
+        with self._db:
+            for record in records:
+                if "file_id" in record:
+                    self._insert(dict(record, created=record.get("created", created)))
+        return len(records)
+
+    @staticmethod
+    def _to_record(row):
+        record = {field: row[field] for field in RECORD_FIELDS}
+        record["created"] = row["created"]
+        if row["extra"]:
+            record.update(json.loads(row["extra"]))
+        return record
+
+
+def open_catalog(path=CATALOG_FILENAME, legacy_pattern='exercise_records_*.json'):
+    # Opens the catalog, importing the old per day JSON records the first
+    # time it is created
+    catalog = SessionCatalog(path)
+    if catalog.created:
+        for legacy in sorted(glob.glob(legacy_pattern)):
+            catalog.import_json(legacy)
+    return catalog
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from app_paths import EXERCISE_CONFIG_PATH
+from binary_session import BINARY_EXTENSION, convert_from_csv, is_binary_session, read_header
+
+CONFIG_PATH = EXERCISE_CONFIG_PATH
+# Binary copies of CSV sessions, kept apart from the recordings in data/
+CACHE_DIRECTORY = "./session_cache"
+
+
+def load_exercise_config(path=CONFIG_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def exercise_from_filename(path, exercise_config):
+    # Kept takes are saved as <file_id>_<exercise name>.csv
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for name in sorted(exercise_config, key=len, reverse=True):
+        if stem.endswith(f"_{name}") or f"_{name}_" in stem:
+            return name
+    return None
+
+
+class RecordedSession:
+    # Read only view of a recorded session. The records are memory mapped as
+    # a NumPy structured array, one float32 field per column, so opening a
+    # session and slicing a time range only touches the pages it needs.
+    def __init__(self, path, exercise_config=None, exercise_name=None):
+        if not is_binary_session(path):
+            path = self._binary_cache(path)
+        self.path = path
+        self.header, offset = read_header(path)
+        if exercise_config is None:
+            exercise_config = load_exercise_config()
+        self.exercise_name = (exercise_name or self.header.get("exercise_name")
+                              or exercise_from_filename(self.header.get("source", path), exercise_config))
+        self.columns = self._column_names(exercise_config)
+        self.dtype = np.dtype([(name, self.header["dtype"]) for name in self.columns])
+        count = (os.path.getsize(path) - offset) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    @staticmethod
+    def _binary_cache(csv_path, cache_directory=CACHE_DIRECTORY):
+        # CSVs are converted once into the cache directory, later opens reuse
+        # the copy as long as it is newer than the CSV. The copy is named
+        # after the CSV's full path and records it as its source, anything
+        # else in its place is left alone.
+        source = os.path.abspath(csv_path)
+        digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]
+        name = f"{os.path.splitext(os.path.basename(csv_path))[0]}.{digest}{BINARY_EXTENSION}"
+        path = os.path.join(cache_directory, name)
+        if os.path.exists(path):
+            if not is_binary_session(path) or read_header(path)[0].get("source") != source:
+                raise ValueError(f"{path} is not a cached copy of {csv_path}, not overwriting it")
+            if os.path.getmtime(path) >= os.path.getmtime(csv_path):
+                return path
+        os.makedirs(cache_directory, exist_ok=True)
+        return convert_from_csv(csv_path, path, source=source)
+
+    def _column_names(self, exercise_config):
+        columns = self.header["columns"]
+        if self.exercise_name in exercise_config:
+            config_columns = exercise_config[self.exercise_name]["columns"]
+            if len(config_columns) == len(columns):
+                return list(config_columns)
+        return list(columns)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    @property
+    def timestamps(self):
+        return self.records[self.columns[0]]
+
+    @property
+    def duration_ms(self):
+        if len(self.records) < 2:
+            return 0.0
+        timestamps = self.timestamps
+        return float(timestamps[-1] - timestamps[0])
+
+    def column(self, name):
+        return self.records[name]
+
+    def array(self):
+        # The records as a plain (n, columns) float32 view
+        return self.records.view(self.header["dtype"]).reshape(len(self.records), len(self.columns))
+
+    def time_slice(self, start_ms=None, end_ms=None):
+        # Records with start_ms <= timestamp < end_ms. Timestamps are sorted,
+        # so this is a binary search on the mapped timestamp column.
+        timestamps = self.timestamps
+        start = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, side='left'))
+        end = len(timestamps) if end_ms is None else int(np.searchsorted(timestamps, end_ms, side='left'))
+        return self.records[start:end]
+
+
+def open_session(path, exercise_config=None, exercise_name=None):
+    return RecordedSession(path, exercise_config, exercise_name)
+
+
+def iter_sessions(directory="./data", exercise_config=None):
+    # Every recorded session in a directory. A binary recording and the CSV
+    # exported from it when the take was kept are listed once, through the
+    # binary recording.
+    if exercise_config is None:
+        exercise_config = load_exercise_config()
+    names = sorted(os.listdir(directory))
+    binaries = {os.path.splitext(name)[0] for name in names if name.endswith(BINARY_EXTENSION)}
+    for name in names:
+        base, ext = os.path.splitext(name)
+        if ext == BINARY_EXTENSION or (ext == ".csv" and base not in binaries):
+            yield open_session(os.path.join(directory, name), exercise_config)
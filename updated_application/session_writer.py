@@ -0,0 +1,231 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+# fsync policies for SessionWriter
+FSYNC_NEVER = "never"        # leave it to the OS
+FSYNC_ON_FLUSH = "flush"     # fsync after every buffered flush
+FSYNC_ON_CLOSE = "close"     # fsync once when the session is closed
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_ON_FLUSH, FSYNC_ON_CLOSE)
+
+# Session metadata (gaps, writer stats, ...) is kept next to the session file
+METADATA_SUFFIX = ".meta.json"
+
+
+def metadata_filename(filename):
+    return os.path.splitext(filename)[0] + METADATA_SUFFIX
+
+
+def complete_rows(values):
+    # Mask of the rows without NaN. The fusion writes NaN for a sensor that
+    # is in a gap, exports leave those rows out.
+    return ~np.isnan(values).any(axis=1)
+
+
+def write_metadata(filename, metadata):
+    with open(metadata_filename(filename), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+class SessionWriter:
+    # Keeps the session CSV open for the whole recording. Rows go into the
+    # file's own buffer and are pushed to the OS when flush_rows rows are
+    # pending or flush_interval seconds have passed since the last flush.
+    def __init__(self, filename, columns, flush_rows=256, flush_interval=1.0, fsync_policy=FSYNC_ON_CLOSE,
+                 value_format="%.7g", timestamp_format="%.3f"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.filename = filename
+        self.columns = list(columns)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.rows_written = 0
+        self.gap_rows = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self._pending = 0
+        # Format of one row written by write_block, "%.7g" keeps every
+        # significant digit of a float32 sample
+        self._row_format = ",".join([timestamp_format] + [value_format] * (len(self.columns) - 1)) + "\n"
+        self._file = self._open()
+        self._opened_at = time.monotonic()
+        self._last_flush = self._opened_at
+        self._closed_at = None
+
+    def _open(self):
+        file = open(self.filename, 'w', newline='', buffering=1 << 16)
+        csv.writer(file).writerow(self.columns)
+        return file
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def write_block(self, timestamps, values):
+        # Write a block of fused samples, timestamps has shape (n,) and values
+        # (n, len(columns) - 1)
+        count = len(timestamps)
+        if count == 0:
+            return
+        if values.shape[1] != len(self.columns) - 1:
+            raise ValueError(f"Block has {values.shape[1] + 1} columns, expected {len(self.columns)}")
+        complete = complete_rows(values)
+        if not complete.all():
+            # Rows in a sensor's gap stay out of the CSV, the gaps are listed
+            # in the session metadata
+            timestamps, values = timestamps[complete], values[complete]
+            self.gap_rows += count - len(timestamps)
+            count = len(timestamps)
+        row_format = self._row_format
+        self._file.write("".join([row_format % (t, *v) for t, v in zip(timestamps.tolist(), values.tolist())]))
+        self._pending += count
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if not self._pending:
+            return
+        if self._pending >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        self.rows_written += self._pending
+        self._pending = 0
+        self.bytes_written = self._file.tell()
+        self.flushes += 1
+        self._last_flush = time.monotonic()
+        if self.fsync_policy == FSYNC_ON_FLUSH:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        if self.fsync_policy != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        self._closed_at = time.monotonic()
+
+    def throughput(self):
+        # Bytes per second over the lifetime of the session
+        end = self._closed_at if self._closed_at is not None else time.monotonic()
+        elapsed = end - self._opened_at
+        return self.bytes_written / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        text = (f"{self.rows_written} rows, {self.bytes_written / 1024:.1f} KB written "
+                f"in {self.flushes} flushes ({self.throughput() / 1024:.1f} KB/s)")
+        if self.gap_rows:
+            text += f", {self.gap_rows} gap rows left out"
+        return text
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ThreadedSessionWriter:
+    # Hands blocks of rows to a SessionWriter running on a background thread
+    # through a bounded queue. submit_block() never blocks: when the queue
+    # is full because the disk is stalled the rows are dropped and counted
+    # instead, so BLE reception keeps going. perf (an Instrumentation) times
+    # the writes on the writer thread.
+    _STOP = object()
+
+    def __init__(self, writer, max_queue=4096, perf=None):
+        self.writer = writer
+        self.perf = perf
+        self.max_queue = max_queue
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.high_water = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def filename(self):
+        return self.writer.filename
+
+    def submit_block(self, timestamps, values):
+        count = len(timestamps)
+        if count == 0:
+            return True
+        try:
+            self._queue.put_nowait((timestamps, values))
+        except queue.Full:
+            self.dropped += count
+            return False
+        self.submitted += count
+        depth = self._queue.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+        return True
+
+    def write_block(self, timestamps, values):
+        self.submit_block(timestamps, values)
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        get = self._queue.get
+        while True:
+            try:
+                item = get(timeout=self.writer.flush_interval)
+            except queue.Empty:
+                if self.error is None:
+                    self.writer.flush_if_due()
+                continue
+            if item is self._STOP:
+                return
+            if self.perf is None:
+                self._write(item)
+            else:
+                started = time.perf_counter_ns()
+                self._write(item)
+                self.perf.add("write", time.perf_counter_ns() - started)
+
+    def _write(self, block):
+        # block is a (timestamps, values) tuple
+        if self.error is None:
+            try:
+                self.writer.write_block(*block)
+                return
+            except (OSError, ValueError) as e:
+                self.error = e
+                print(f"Session writer error: {e}")
+        self.failed += len(block[0])
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        self.writer.close()
+
+    def status(self):
+        # Short text for the status line, empty while nothing is wrong
+        if self.error is not None:
+            return f"Writer error: {self.error} ({self.failed} rows lost)"
+        if self.dropped:
+            return f"Disk too slow: {self.dropped} rows dropped (backlog {self.backlog()}/{self.max_queue})"
+        if self.backlog() > self.max_queue // 2:
+            return f"Writer falling behind: backlog {self.backlog()}/{self.max_queue}"
+        return ""
+
+    def summary(self):
+        return (f"{self.writer.summary()}, {self.submitted} rows queued, {self.dropped} dropped, {self.failed} failed, "
+                f"peak backlog {self.high_water}/{self.max_queue}")
@@ -0,0 +1,184 @@
+import json
+import time
+
+from ble_discovery import DeviceCache
+
+STATIONS_FILENAME = 'stations.json'
+DEFAULT_STATION = "Station 1"
+
+
+class Station:
+    # One sensor kit with its own recording. The session and the exercise
+    # config use the kit's local sensor ids (1-4), on the shared
+    # ConnectionManager the sensors are keyed (station name, sensor id) so
+    # several kits can be connected at the same time.
+    #
+    # sensors maps sensor id -> (device name, notify characteristic UUID)
+    def __init__(self, name, sensors):
+        self.name = name
+        self.sensors = sensors
+        self.session = None
+        self.packets = 0
+        self.bytes_received = 0
+        self.started = None
+
+    def key(self, sensor_id):
+        return (self.name, sensor_id)
+
+    def sensor_name(self, sensor_id):
+        return self.sensors[sensor_id][0]
+
+    @property
+    def recording(self):
+        return self.session is not None
+
+    def start(self, session):
+        self.session = session
+        self.packets = 0
+        self.bytes_received = 0
+        self.started = time.perf_counter()
+
+    def finish(self):
+        session, self.session = self.session, None
+        return session
+
+    def handle_packet(self, arrival_ns, data, key):
+        # Runs on the shared BLE loop
+        self.packets += 1
+        self.bytes_received += len(data)
+        self.session.handle_packet(arrival_ns, data, key[1])
+
+    def stats(self):
+        # Throughput and losses of the current recording
+        session = self.session
+        if session is None:
+            return {"station": self.name, "recording": False}
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        writer = session.writer
+        return {
+            "station": self.name,
+            "recording": True,
+            "elapsed_s": elapsed,
+            "packets": self.packets,
+            "packets_per_s": self.packets / elapsed,
+            "bytes_per_s": self.bytes_received / elapsed,
+            "rows": session.fusion.rows_emitted,
+            "rows_per_s": session.fusion.rows_emitted / elapsed,
+            "bad_frames": session.error_count,
+            "dropped_rows": writer.dropped + writer.failed,
+            "gaps": len(session.fusion.gaps),
+        }
+
+
+def station_sensors(base_sensors, suffix=""):
+    # Device names of a kit are the default names plus the kit's suffix,
+    # e.g. "Sense Right Hand B"
+    return {sensor_id: (f"{name}{suffix}", char_uuid) for sensor_id, (name, char_uuid) in base_sensors.items()}
+
+
+def load_stations(base_sensors, path=STATIONS_FILENAME, device_cache=None):
+    # stations.json lists the kits, e.g.
+    #   [{"name": "Station A", "suffix": " A"},
+    #    {"name": "Station B", "addresses": {"Sense Right Hand": "D1:4F:..."}}]
+    # Addresses are keyed by the default device name and are pinned in the
+    # device cache, so kits whose devices all share the default names can be
+    # told apart: the pinned sensors are never scanned for by name, and name
+    # scans for other kits skip their addresses. Without the file there is
+    # one station with the default names.
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return [Station(DEFAULT_STATION, dict(base_sensors))]
+    stations = []
+    for entry in config:
+        name = entry["name"]
+        addresses = entry.get("addresses", {})
+        if addresses and not entry.get("suffix"):
+            # Explicit addresses need names of their own in the device
+            # cache, no device advertises these
+            suffix = f" ({name})"
+        else:
+            suffix = entry.get("suffix", "")
+        sensors = station_sensors(base_sensors, suffix)
+        if device_cache is not None:
+            for sensor_id, (base_name, _) in base_sensors.items():
+                if base_name in addresses:
+                    device_cache.pin(sensors[sensor_id][0], addresses[base_name])
+        stations.append(Station(name, sensors))
+    if len({station.name for station in stations}) != len(stations):
+        raise ValueError(f"Station names in {path} must be unique")
+    return stations
+
+
+class StationHub:
+    # Serves every station from one ConnectionManager, so one BLE event loop
+    # handles all kits. on_disconnect(station, sensor_id) is called on the BLE
+    # loop after the station's session was updated, on_reconnect once the
+    # sensor is connected again.
+    # manager_options (e.g. a simulator's client_class and scanner_class) go
+    # to the ConnectionManager.
+    def __init__(self, stations, device_cache=None, on_disconnect=None, on_reconnect=None, **manager_options):
+        self.stations = {station.name: station for station in stations}
+        self.on_disconnect = on_disconnect
+        self.on_reconnect = on_reconnect
+        sensors = {
+            station.key(sensor_id): sensor
+            for station in stations for sensor_id, sensor in station.sensors.items()
+        }
+        if device_cache is None:
+            device_cache = DeviceCache()
+        # bleak and the asyncio loop are only needed once a station records
+        from connection_manager import ConnectionManager
+        self.manager = ConnectionManager(sensors, device_cache=device_cache, on_disconnect=self._sensor_disconnected,
+                                         on_reconnect=self._sensor_reconnected, on_resume=self._sensor_resumed,
+                                         **manager_options)
+
+    def start(self, station, session):
+        # Returns the manager's start_recording future, local_result() maps
+        # its result to the station's sensor ids
+        station.start(session)
+        return self.manager.start_recording([station.key(sensor) for sensor in session.sensors],
+                                            station.handle_packet)
+
+    def stop(self, station):
+        # Returns (session, stop latency in ms, the recording's stats)
+        latency = self.manager.stop_recording([station.key(sensor) for sensor in station.sensors])
+        stats = station.stats()
+        return station.finish(), latency, stats
+
+    def stats(self):
+        return [station.stats() for station in self.stations.values()]
+
+    def _sensor_disconnected(self, key):
+        station = self.stations[key[0]]
+        if station.recording and key[1] in station.session.sensors and self.manager.is_recording(key):
+            # The station's other sensors keep recording
+            station.session.sensor_disconnected(key[1])
+        if self.on_disconnect is not None:
+            self.on_disconnect(station, key[1])
+
+    def _sensor_resumed(self, key, reconnected):
+        # Before the first packet of a new connection or of the recording is
+        # handled
+        station = self.stations[key[0]]
+        if station.recording and key[1] in station.session.sensors and self.manager.is_recording(key):
+            station.session.sensor_resumed(key[1], reconnected)
+
+    def _sensor_reconnected(self, key):
+        if self.on_reconnect is not None:
+            self.on_reconnect(self.stations[key[0]], key[1])
+
+    def shutdown(self):
+        self.manager.shutdown()
+
+
+def local_result(result):
+    # Maps the (station, sensor id) keys in a start_recording result back to
+    # the station's sensor ids
+    return {
+        "connected": [key[1] for key in result["connected"]],
+        "streaming": [key[1] for key in result["streaming"]],
+        "ready": result["ready"],
+        "first_sample_ms": {key[1]: elapsed for key, elapsed in result["first_sample_ms"].items()},
+    }
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+
+# Nominal time between two samples of one sensor, used to place the frames
+# of a packet when there is no previous packet to spread them from
+NOMINAL_SAMPLE_PERIOD_MS = 10.0
+
+now_ns = time.perf_counter_ns
+
+
+class SessionClock:
+    # Shared epoch for every sensor of a recording. Timestamps are
+    # milliseconds since the epoch on the monotonic perf_counter clock, so
+    # they never jump with NTP or wall clock adjustments. The epoch is taken
+    # from the first notification of the session unless started explicitly.
+    __slots__ = ("epoch_ns",)
+
+    def __init__(self, epoch_ns=None):
+        self.epoch_ns = epoch_ns
+
+    def start(self, epoch_ns=None):
+        self.epoch_ns = now_ns() if epoch_ns is None else epoch_ns
+
+
+class PacketTimestamper:
+    # Assigns a timestamp to each frame of a sensor's packets. The arrival
+    # time is taken once per notification and the frames it carried are
+    # spread evenly since the previous packet of the same sensor, the last
+    # frame getting the arrival time.
+    __slots__ = ("clock", "nominal_period_ms", "max_period_ms", "last_ms")
+
+    def __init__(self, clock, nominal_period_ms=NOMINAL_SAMPLE_PERIOD_MS):
+        self.clock = clock
+        self.nominal_period_ms = nominal_period_ms
+        # Frames are never spread wider than this, after a stall the gap
+        # belongs before the packet, not inside it
+        self.max_period_ms = 2 * nominal_period_ms
+        self.last_ms = None
+
+    def stamp_packets(self, arrivals_ns, counts):
+        # Timestamps of the frames of several packets in one go, arrivals_ns
+        # and counts hold one entry per packet in arrival order. A batch is a
+        # few packets of one or two frames, plain floats beat numpy there.
+        if self.clock.epoch_ns is None:
+            self.clock.start(arrivals_ns[0])
+        epoch_ns = self.clock.epoch_ns
+        last = self.last_ms
+        timestamps = []
+        for arrival_ns, count in zip(arrivals_ns, counts):
+            now = (arrival_ns - epoch_ns) / 1e6
+            if last is None:
+                start = max(now - count * self.nominal_period_ms, 0.0)
+            else:
+                start = max(last, now - count * self.max_period_ms)
+            timestamps += [start + (now - start) * i / count for i in range(1, count + 1)]
+            last = now
+        self.last_ms = last
+        return np.array(timestamps)